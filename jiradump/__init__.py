@@ -10,7 +10,28 @@ from jira.client import JIRA
 from logging import debug, info, error, getLogger
 from jiradump.parsers import BasicFieldParser, DateTimeFieldParser, \
     SecondsDurationParser, TimeInStatusFieldParser
+from jiradump.aggregate import AGGREGATE_FUNCTIONS, Aggregator, \
+    summary_headers
+from jiradump.bulk import KeyFetcher, read_keys
+from jiradump.columnar import ColumnarWriter, column_types
+from jiradump.follow import DEFAULT_MAX_POLL_INTERVAL, \
+    DEFAULT_POLL_INTERVAL, Follower
+from jiradump.index import INDEX_SUFFIX, IndexBuilder
+from jiradump.metrics import DEFAULT_STATSD_PORT, Metrics, MetricsAdapter, \
+    StatsdClient, statsd_address
+from jiradump.recording import RecordingAdapter, ReplayAdapter, \
+    ResponseRecorder
+from jiradump.relations import RelatedFieldParser, RelatedIssues, \
+    split_related_field
+from jiradump.sinks import OUTPUT_FORMATS, Sink, read_sink_specs, \
+    write_sinks
+from jiradump.sorting import DEFAULT_SORT_MEMORY, ExternalSorter, \
+    make_sort_key, parse_sort_spec
+from jiradump.subresources import DEFAULT_WORKERS, SUBRESOURCE_EXPORTERS
+from jiradump.transport import wrapped_sessions
+from jiradump.writers import get_compressor, open_output
 import argparse
+import atexit
 import jira.resources
 import logging
 import sys
@@ -87,7 +108,19 @@ def build_parser():
                         'delimiter for fields with multiple values. Defaults '
                         "to comma space, i.e. ', '", default=', ')
     parser.add_argument('-o', '--output', nargs='?', help='specify output '
-                        'filename. Defaults to standard out')
+                        'filename. Names ending in .gz, .bz2 or .xz are '
+                        'compressed. Defaults to standard out')
+    parser.add_argument('-F', '--format', nargs='?', help='specify output '
+                        'format. columnar writes a directory of typed, '
+                        'memory mappable column files. Defaults to '
+                        'delimited', choices=OUTPUT_FORMATS,
+                        default='delimited')
+    parser.add_argument('--outputs', nargs='?', help='write the issues to '
+                        'each of the outputs listed in the JSON *filename*, '
+                        'fetching them only once. Outputs can set their own '
+                        'output, fields, delimiter, subdelimiter and format, '
+                        'defaulting to the command line options',
+                        metavar='OUTPUTS_FILE')
     parser.add_argument('-m', '--max-results', nargs='?', help='specify '
                         'maximum issues returned. Defaults to %s' %
                         DEFAULT_MAX_RESULTS, default=DEFAULT_MAX_RESULTS)
@@ -95,6 +128,72 @@ def build_parser():
                         'of issue fields to dump, one per line. Default '
                         'fields: ' + ', '.join(DEFAULT_OUTPUT_FIELDS),
                         metavar='FIELDS_FILE')
+    parser.add_argument('-s', '--sort-by', action='append', help='sort the '
+                        'output by an output column. Optionally add :TYPE, '
+                        'one of string, numeric or date, defaulting to '
+                        'string, and then :desc to sort in descending order. '
+                        'Repeat to sort by more columns',
+                        metavar='COLUMN:TYPE:desc')
+    parser.add_argument('--sort-memory', nargs='?', type=int, help='specify '
+                        'megabytes of rows to hold in memory while sorting '
+                        'before spilling them to temporary files. Defaults to '
+                        '%s' % DEFAULT_SORT_MEMORY,
+                        default=DEFAULT_SORT_MEMORY, metavar='MEGABYTES')
+    parser.add_argument('--sort-temp-dir', nargs='?', help='specify directory '
+                        'for temporary sort files. Defaults to the system '
+                        'temporary directory', metavar='DIRECTORY')
+    parser.add_argument('-g', '--group-by', action='append', help='write a '
+                        'summary row for each group of values of the output '
+                        'column instead of a row per issue. Repeat to group '
+                        'by more columns', metavar='COLUMN')
+    parser.add_argument('-a', '--aggregate', action='append', help='add a '
+                        'summary column to the grouped output. FUNCTION is '
+                        'one of %s, where NN is a percentile. Defaults to '
+                        'count. COLUMN can be left out to count rows' %
+                        ', '.join(AGGREGATE_FUNCTIONS),
+                        metavar='FUNCTION:COLUMN')
+    parser.add_argument('--index', action='store_true', help='also write '
+                        'an index of each issue key\'s row position in the '
+                        'output file, to the output filename plus %s. See '
+                        'jiradump-index for lookups' % INDEX_SUFFIX)
+    parser.add_argument('--follow', action='store_true', help='keep '
+                        'running, writing rows for new and changed issues as '
+                        'they are found, tagged with the type of change')
+    parser.add_argument('--poll-interval', nargs='?', type=float,
+                        help='specify the shortest time between polls for '
+                        'changes when following. Defaults to %s' %
+                        DEFAULT_POLL_INTERVAL, default=DEFAULT_POLL_INTERVAL,
+                        metavar='SECONDS')
+    parser.add_argument('--max-poll-interval', nargs='?', type=float,
+                        help='specify the longest time between polls for '
+                        'changes when following. Defaults to %s' %
+                        DEFAULT_MAX_POLL_INTERVAL,
+                        default=DEFAULT_MAX_POLL_INTERVAL, metavar='SECONDS')
+    parser.add_argument('--metrics-file', nargs='?', help='write run metrics '
+                        'to *filename* for the Prometheus textfile collector')
+    parser.add_argument('--statsd', nargs='?', help='send run metrics to the '
+                        'StatsD server at HOST:PORT over UDP. PORT defaults '
+                        'to %s' % DEFAULT_STATSD_PORT, type=statsd_address,
+                        metavar='HOST:PORT')
+    parser.add_argument('--comments', nargs='?', help='also write the '
+                        'comments on each issue to *filename*, one per row',
+                        metavar='COMMENTS_FILE')
+    parser.add_argument('--worklogs', nargs='?', help='also write the '
+                        'worklogs on each issue to *filename*, one per row',
+                        metavar='WORKLOGS_FILE')
+    parser.add_argument('--workers', nargs='?', type=int, help='specify how '
+                        'many requests to make at once when fetching extra '
+                        'details. Defaults to %s' % DEFAULT_WORKERS,
+                        default=DEFAULT_WORKERS)
+
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--record', nargs='?', help='save every JIRA API '
+                       'response received to the *archive* file',
+                       metavar='ARCHIVE')
+    group.add_argument('--replay', nargs='?', help='answer JIRA API requests '
+                       'from a --record *archive* file instead of the '
+                       'server. No password is needed',
+                       metavar='ARCHIVE')
 
     group = parser.add_mutually_exclusive_group(required=True)
     group.add_argument('--list-fields', help='list all field IDs and names '
@@ -104,6 +203,10 @@ def build_parser():
                        action='store_true')
     group.add_argument('--list-statuses', help='list all status IDs and names '
                        'known and exit', action='store_true')
+    group.add_argument('--keys', nargs='?', help='dump the issues with the '
+                       'keys listed in *filename*, one per line, in the same '
+                       "order. Use '-' to read keys from standard input",
+                       metavar='KEYS_FILE')
     group.add_argument('filter', metavar='FILTER', nargs='?',
                        help='specifies the filter name or ID to dump. Only '
                        'favorite filters can be referenced by name')
@@ -123,9 +226,8 @@ def list_items(items, delimiter, output, flip=False):
     output.write('\n'.join(utf8))
 
     # If we are writing to standard output, add a final newline to be nice.
-    if output == sys.stdout:
+    if output.stream == sys.stdout:
         output.write('\n')
-    sys.exit()
 
 
 def get_jira_server():
@@ -143,6 +245,136 @@ def get_jiradump_user():
     return getuser()
 
 
+def export_metrics(metrics, args, result):
+    """Record the run summary and write out metrics as requested.
+
+    result is a one item list, set to True once the run has finished, so this
+    can be registered to run at exit before we know how the run went.
+    """
+    metrics.finish(result[0])
+    if args.metrics_file:
+        try:
+            metrics.write_textfile(args.metrics_file)
+        except (IOError, OSError) as err:
+            error('Failed to write metrics to %s: %s' %
+                  (args.metrics_file, err))
+    metrics.send_statsd()
+
+
+def issue_rows(issues, input_fields, field_ids, field_parsers, typed=False):
+    """Yield the parsed output values for each issue as UTF-8 strings.
+
+    If typed is set, yield typed values from the parsers instead.
+    """
+    for issue in issues:
+        # Dirty hack to make the "key" attribute available at the same
+        # level as all the other fields.
+        issue.fields.issuekey = issue.key
+
+        # Look up and parse the individual values for each field in this issue.
+        issue_values = []
+
+        for field in input_fields:
+            # Grab the values.
+            field_values = getattr(issue.fields, field_ids[field], u'')
+            if typed:
+                issue_values += field_parsers[field].parse_typed(field_values)
+                continue
+            # Parse the values.
+            field_values = field_parsers[field].parse_values(field_values)
+
+            # Convert from Unicode to UTF-8.
+            issue_values += [value.encode('utf-8') for value in field_values]
+
+        yield issue_values
+
+
+def read_fields(filename=None):
+    """Return the fields listed in the file, or the default fields."""
+    if not filename:
+        return DEFAULT_OUTPUT_FIELDS
+    input_fields = []
+    with open(filename) as fields_file:
+        for field in fields_file:
+            field = field.strip()
+            if field:
+                input_fields.append(field)
+    return input_fields
+
+
+def output_columns(input_fields, field_parsers, field_schemas):
+    """Return the output column headers and the type of each column."""
+    # First handle any header splitting.
+    output_fields = []
+    for field in input_fields:
+        output_fields += field_parsers[field].headers()
+    debug('Output columns: ' + ', '.join(output_fields))
+
+    # Work out the type of each output column, from the parsers and the JIRA
+    # field schemas.
+    output_types = []
+    for field in input_fields:
+        output_types += column_types(field_parsers[field],
+                                     field_schemas.get(field))
+    return output_fields, output_types
+
+
+def check_columns(args):
+    """Check summary and sort columns before anything is fetched or written.
+
+    Fields split into columns by the issues found, like Time in Status, leave
+    the output headers unknown until then, so only the aggregate functions
+    are checked here. Everything is checked again once the headers are known.
+    """
+    columns = read_fields(args.fields)
+    if any(FIELD_PARSERS.get(field, BasicFieldParser).split_columns
+           for field in columns):
+        columns = None
+    if args.group_by or args.aggregate:
+        # Summaries are sorted by their own headers.
+        columns = summary_headers(args.group_by or [], args.aggregate,
+                                  columns)
+    for spec in args.sort_by or []:
+        column = parse_sort_spec(spec)[0]
+        if columns is not None and column not in columns:
+            raise ValueError('Unknown sort column: ' + column)
+
+
+def write_rows(rows, output_fields, delimiter, output, index=None):
+    """Write the header and rows as delimited text and close the output.
+
+    If given an IndexBuilder, the position of each row is added to it by the
+    value in its Key column. Returns the number of rows written.
+    """
+    # Leave off the newline so we can make sure we don't add a final blank
+    # line when sending output to a file.
+    header = delimiter.join([field.encode('utf-8')
+                             for field in output_fields])
+    output.write(header)
+
+    if index is not None:
+        key_column = output_fields.index('Key')
+        offset = len(header)
+
+    # Write out the summary for each issue.
+    rows_written = 0
+    for issue_values in rows:
+        # We add the newline before each new row so we don't end with a
+        # final blank line when sending output to a file.
+        row = delimiter.join(issue_values)
+        output.write('\n' + row)
+        rows_written += 1
+        if index is not None:
+            index.add(issue_values[key_column], offset + 1, len(row))
+            offset += 1 + len(row)
+
+    # If we are writing to standard output, add a final newline to be nice.
+    if output.stream == sys.stdout:
+        output.write('\n')
+    output.close()
+    return rows_written
+
+
 def main():
     """Parse arguments and retrieve filters, fields, status, or dump issues."""
     # Parse the command line arguments.
@@ -153,6 +385,12 @@ def main():
                                                          logging.DEBUG))
     debug('Verbosity level: %s' % args.verbose)
 
+    # Collect metrics for every run, exporting them at exit if requested.
+    metrics = Metrics(StatsdClient(args.statsd) if args.statsd else None)
+    run_finished = [False]
+    if args.metrics_file or args.statsd:
+        atexit.register(export_metrics, metrics, args, run_finished)
+
     debug('Building credentials.')
     # Guess the username if possible.
     if args.username:
@@ -160,8 +398,11 @@ def main():
     else:
         args.username = get_jiradump_user()
 
-    # Get the password, reading from a file if requested.
-    if args.passfile and args.passfile[0] != '-':
+    # Get the password, reading from a file if requested. Replayed runs
+    # never talk to the server, so don't need one.
+    if args.replay:
+        password = None
+    elif args.passfile and args.passfile[0] != '-':
         try:
             password = open(args.passfile[0]).read().strip()
         except IOError as err:
@@ -187,26 +428,84 @@ def main():
 
     # Configure our JIRA interface.
     options = {'server': args.jira}
-    jira = JIRA(options=options, basic_auth=(args.username, password))
-    info('Connecting as %s to %s' % (args.username, args.jira))
-
-    # Create a mapping of field names (including custom ones) to field IDs.
-    debug('Mapping field names to IDs.')
-    # TODO: Add error handling
-    field_ids = dict([(field['name'], field['id']) for field in jira.fields()])
-
-    # Create a mapping of filters names (including custom ones) to filter IDs.
-    debug('Mapping favorite filter names to IDs.')
-    # TODO: Add error handling
-    filter_ids = dict([(fav.name, fav.id) for fav in jira.favourite_filters()])
+    if args.replay:
+        replay = ReplayAdapter(args.replay)
+        basic_auth = None
+    else:
+        basic_auth = (args.username, password)
+        info('Connecting as %s to %s' % (args.username, args.jira))
+    if args.record:
+        recorder = ResponseRecorder(args.record)
+        atexit.register(recorder.close)
+
+    def wrap_adapter(adapter):
+        """Replay, record and measure requests as asked."""
+        if args.replay:
+            adapter = replay
+        if args.record:
+            adapter = RecordingAdapter(adapter, recorder)
+        return MetricsAdapter(adapter, metrics)
+
+    with wrapped_sessions(wrap_adapter):
+        jira = JIRA(options=options, basic_auth=basic_auth)
+
+    with metrics.stage('connect'):
+        # Create a mapping of field names (including custom ones) to field
+        # IDs.
+        debug('Mapping field names to IDs.')
+        # TODO: Add error handling
+        fields = jira.fields()
+        field_ids = dict([(field['name'], field['id']) for field in fields])
+        field_schemas = dict([(field['name'], field.get('schema'))
+                              for field in fields])
+
+        # Create a mapping of filters names (including custom ones) to filter
+        # IDs.
+        debug('Mapping favorite filter names to IDs.')
+        # TODO: Add error handling
+        filter_ids = dict([(fav.name, fav.id)
+                           for fav in jira.favourite_filters()])
 
-    # Open the output file.
+    # Open the output file. Writes are handed off to a background thread so
+    # a slow disk or pipe doesn't hold up fetching and parsing. Columnar
+    # dumps are written to a directory of their own instead.
     if args.output:
         info('Writing output to %s', args.output)
-        output = open(args.output, 'w')
     else:
         debug('Writing output to standard output.')
-        output = sys.stdout
+    dumping = args.filter or args.keys
+    if args.outputs and dumping:
+        if (args.group_by or args.aggregate or args.sort_by or args.index or
+                args.follow):
+            raise ValueError('Multiple outputs can not be summarized, '
+                             'sorted, indexed or followed')
+        output = None
+    elif args.format == 'columnar' and dumping:
+        if not args.output:
+            raise ValueError('Columnar output needs an output directory')
+        if (args.group_by or args.aggregate or args.sort_by or args.index or
+                args.follow):
+            raise ValueError('Columnar output can not be summarized, '
+                             'sorted, indexed or followed')
+        output = None
+    elif args.index and dumping and (
+            not args.output or get_compressor(args.output) or args.follow):
+        raise ValueError('Indexed output needs an uncompressed output file '
+                         'and can not be followed')
+    elif args.index and dumping and 'Key' not in (
+            (args.group_by or []) if args.group_by or args.aggregate
+            else read_fields(args.fields)):
+        # Summaries only have the columns they are grouped by.
+        raise ValueError('Indexed output needs a Key column')
+    elif args.follow and (args.keys or args.group_by or args.aggregate or
+                          args.sort_by):
+        raise ValueError('Only filters can be followed, and followed output '
+                         'can not be summarized or sorted')
+    else:
+        if dumping:
+            # Catch bad columns before the output is truncated.
+            check_columns(args)
+        output = open_output(args.output)
 
     # TODO: Optionally add the command line used to produce the output.
 
@@ -219,92 +518,252 @@ def main():
                              for status in jira.statuses()])
 
         list_items(status_names, args.delimiter, output)
+        output.close()
+        run_finished[0] = True
         sys.exit()
 
     # If we are just listing the available fields, do so now and exit.
     if args.list_fields:
         list_items(field_ids, args.delimiter, output, flip=True)
+        output.close()
+        run_finished[0] = True
         sys.exit()
 
     # If we are just listing the favorite filters, do so now and exit.
     if args.list_filters:
         list_items(filter_ids, args.delimiter, output, flip=True)
+        output.close()
+        run_finished[0] = True
         sys.exit()
 
     # Parse the filter issues and output.
 
-    # Grab the main filter.
-    debug('Looking up the issue filter in JIRA.')
-    if args.filter in filter_ids:
-        info('Found filter %s in favorites as ID %s.' %
-             (filter_ids[args.filter], args.filter))
-        dump_filter = jira.filter(filter_ids[args.filter])
-    else:
-        # TODO: Added error handling
-        info('Looking up filter using %s as an ID.' % args.filter)
-        dump_filter = jira.filter(args.filter)
-
-    # Grab the issues from the filter.
-    info('Retrieving up to %s issues from filter %s (ID %s).' %
-         (args.max_results, dump_filter.name, dump_filter.id))
-    issues = jira.search_issues(dump_filter.jql, maxResults=args.max_results)
-
-    # Create the list of fields we will dump.
-    if args.fields:
+    if not args.keys:
+        # Grab the main filter.
+        debug('Looking up the issue filter in JIRA.')
+        if args.filter in filter_ids:
+            info('Found filter %s in favorites as ID %s.' %
+                 (filter_ids[args.filter], args.filter))
+            dump_filter = jira.filter(filter_ids[args.filter])
+        else:
+            # TODO: Added error handling
+            info('Looking up filter using %s as an ID.' % args.filter)
+            dump_filter = jira.filter(args.filter)
+
+    # Create the list of fields we will dump. With several outputs, that's
+    # every field any of them needs.
+    sinks = []
+    if args.outputs:
+        defaults = dict((option, getattr(args, option))
+                        for option in ('output', 'fields', 'delimiter',
+                                       'subdelimiter', 'format'))
+        for spec in read_sink_specs(args.outputs, defaults):
+            fields = spec['fields']
+            if not isinstance(fields, list):
+                fields = read_fields(fields)
+            sinks.append(Sink(spec, fields))
         input_fields = []
-        with open(args.fields) as fields_file:
-            for field in fields_file:
-                field = field.strip()
-                if field:
-                    input_fields.append(field)
+        for sink in sinks:
+            input_fields += [field for field in sink.fields
+                             if field not in input_fields]
     else:
-        input_fields = DEFAULT_OUTPUT_FIELDS
+        input_fields = read_fields(args.fields)
     debug('Input fields from filter: ' + ', '.join(input_fields))
 
+    # Columns from related issues, such as Parent.Summary, read the field
+    # holding the relation, and look up the related issues from a cache.
+    related = RelatedIssues(jira, field_ids, field_schemas, args.workers)
+    related_fields = {}
+    for field in input_fields:
+        relation = split_related_field(field, field_ids)
+        if relation:
+            related_fields[field] = relation
+    for field, (relation, target) in related_fields.iteritems():
+        field_ids[field] = related.add_column(field, relation, target)
+
     # Ensure all the fields we want to use are valid.
     unknown_fields = set(input_fields) - set(field_ids.keys())
     if unknown_fields:
         raise ValueError('Unknown field(s): ' + ', '.join(unknown_fields))
 
-    field_parsers = {}
-
-    for field in input_fields:
+    # Comments and worklogs aren't always included by default, so ask for
+    # them when we need them.
+    search_fields = None
+    subresources = [name for name, _ in SUBRESOURCE_EXPORTERS
+                    if getattr(args, name)]
+    if subresources:
+        search_fields = ','.join(['*navigable', 'comment', 'worklog'])
+    if sinks:
+        # Only fetch the fields the outputs need, all in one go.
+        needed_ids = set(field_ids[field] for field in input_fields)
+        # Issues found here are also used as related issues, so fetch the
+        # fields related columns read from them too.
+        needed_ids.update(*related.targets.values())
+        if subresources:
+            needed_ids.update(['comment', 'worklog'])
+        search_fields = ','.join(sorted(needed_ids - set(['issuekey']))) \
+            or None
+
+    if args.keys:
+        # Look up the issues by key, keeping them in the order given.
+        if args.keys == '-':
+            keys = read_keys(sys.stdin)
+        else:
+            with open(args.keys) as keys_file:
+                keys = read_keys(keys_file)
+        with metrics.stage('search'):
+            found, _ = KeyFetcher(jira, search_fields, metrics).fetch(
+                keys, args.workers)
+        issues = [found[key] for key in keys if key in found]
+    elif args.follow:
+        # The first poll is a normal search of the whole filter, fetched in
+        # pages of up to the maximum results.
+        info('Retrieving issues from filter %s (ID %s), %s at a time.' %
+             (dump_filter.name, dump_filter.id, args.max_results))
+        follower = Follower(jira, dump_filter.jql, args.max_results, metrics,
+                            search_fields, args.poll_interval,
+                            args.max_poll_interval)
+        with metrics.stage('search'):
+            changes = follower.poll()
+        issues = [issue for _, issue in changes]
+    else:
+        # Grab the issues from the filter.
+        info('Retrieving up to %s issues from filter %s (ID %s).' %
+             (args.max_results, dump_filter.name, dump_filter.id))
+        with metrics.stage('search'):
+            issues = jira.search_issues(dump_filter.jql,
+                                        maxResults=args.max_results,
+                                        fields=search_fields)
+        metrics.inc('jiradump_issues_fetched_total', len(issues))
+
+    def make_parser(field, subdelimiter):
+        """Set up the field's parser for the issues."""
+        if field in related_fields:
+            target = related_fields[field][1]
+            Parser = FIELD_PARSERS.get(target, BasicFieldParser)
+            return RelatedFieldParser(field, issues, jira, subdelimiter,
+                                      related,
+                                      Parser(target, [], jira, subdelimiter))
         Parser = FIELD_PARSERS.get(field, BasicFieldParser)
-        field_parsers[field] = Parser(field, issues, jira, args.subdelimiter)
-
-    # Create a header row for the output.
-    # First handle any header splitting.
-    output_fields = []
-    for field in input_fields:
-        output_fields += field_parsers[field].headers()
-    debug('Output columns: ' + ', '.join(output_fields))
-
-    # Leave off the newline so we can make sure we don't add a final blank
-    # line when sending output to a file.
-    output.write(args.delimiter.join(output_fields))
+        return Parser(field, issues, jira, subdelimiter)
 
-    # Write out the summary for each issue.
-    for issue in issues:
-        # Dirty hack to make the "key" attribute available at the same
-        # level as all the other fields.
-        issue.fields.issuekey = issue.key
-
-        # Look up and parse the individual values for each field in this issue.
-        issue_values = []
-
-        for field in input_fields:
-            # Grab the values.
-            field_values = getattr(issue.fields, field_ids[field], u'')
-            # Parse the values.
-            field_values = field_parsers[field].parse_values(field_values)
-
-            # Convert from Unicode to UTF-8.
-            issue_values += [value.encode('utf-8') for value in field_values]
-
-        # We add the newline before each new row so we don't end with a
-        # final blank line when sending output to a file.
-        output.write('\n' + args.delimiter.join(issue_values))
+    field_parsers = {}
 
-    # If we are writing to standard output, add a final newline to be nice.
-    if output == sys.stdout:
-        output.write('\n')
+    with metrics.stage('prepare'):
+        if related_fields:
+            related.prefetch(issues)
+        if sinks:
+            # Outputs share the parsers for any fields they parse the same.
+            shared_parsers = {}
+            for sink in sinks:
+                for field in sink.fields:
+                    key = (field, sink.subdelimiter)
+                    if key not in shared_parsers:
+                        shared_parsers[key] = make_parser(field,
+                                                          sink.subdelimiter)
+                    sink.parsers[field] = shared_parsers[key]
+        else:
+            for field in input_fields:
+                field_parsers[field] = make_parser(field, args.subdelimiter)
+
+    if not sinks:
+        # Create a header row for the output, and work out column types.
+        output_fields, output_types = output_columns(input_fields,
+                                                     field_parsers,
+                                                     field_schemas)
+
+    if sinks:
+        # Parse each issue once and write it to all the outputs.
+        with metrics.stage('write'):
+            for sink in sinks:
+                sink.open(*output_columns(sink.fields, sink.parsers,
+                                          field_schemas))
+            rows_written = write_sinks(issues, sinks, field_ids)
+            for sink in sinks:
+                sink.close()
+    elif args.format == 'columnar':
+        # Columnar output takes the typed values straight from the parsers.
+        writer = ColumnarWriter(args.output, output_fields, output_types)
+        with metrics.stage('write'):
+            for issue_values in issue_rows(issues, input_fields, field_ids,
+                                           field_parsers, typed=True):
+                writer.add(issue_values)
+            writer.close()
+        rows_written = writer.rows
+    elif args.follow:
+        info('Following filter %s for changes. Interrupt to stop.' %
+             dump_filter.name)
+        output.write(args.delimiter.join(
+            ['Change'] + [field.encode('utf-8') for field in output_fields]))
+        polls = follower.changes()
+        try:
+            while True:
+                if related_fields:
+                    related.prefetch([issue for _, issue in changes])
+                rows = issue_rows([issue for _, issue in changes],
+                                  input_fields, field_ids, field_parsers)
+                for (change, _), issue_values in zip(changes, rows):
+                    output.write('\n' + args.delimiter.join(
+                        [change] + issue_values))
+                # Get the rows out as soon as they are found.
+                output.flush()
+                metrics.inc('jiradump_rows_written_total', len(changes))
+                changes = next(polls)
+        except KeyboardInterrupt:
+            info('Stopped following.')
+        if output.stream == sys.stdout:
+            output.write('\n')
+        output.close()
+        # Rows are counted as they are written.
+        rows_written = 0
+    else:
+        # Summarize the issues instead, if asked. The summary is a table of
+        # its own, which can be sorted and written like any other.
+        if args.group_by or args.aggregate:
+            aggregator = Aggregator(args.group_by or [], args.aggregate,
+                                    output_fields, output_types)
+            with metrics.stage('aggregate'):
+                for issue_values in issue_rows(issues, input_fields,
+                                               field_ids, field_parsers,
+                                               typed=True):
+                    aggregator.add(issue_values)
+            output_fields = aggregator.headers
+            rows = aggregator.rows()
+        else:
+            rows = issue_rows(issues, input_fields, field_ids, field_parsers)
+
+        # Sort the rows if asked, spilling them to disk if there are too
+        # many.
+        if args.sort_by:
+            sorter = ExternalSorter(make_sort_key(args.sort_by,
+                                                  output_fields),
+                                    args.sort_memory * 1024 * 1024,
+                                    args.sort_temp_dir)
+            with metrics.stage('sort'):
+                for issue_values in rows:
+                    sorter.add(issue_values)
+            rows = sorter
+
+        with metrics.stage('write'):
+            index = IndexBuilder() if args.index else None
+            rows_written = write_rows(rows, output_fields, args.delimiter,
+                                      output, index)
+            if index is not None:
+                debug('Writing index to %s' % (args.output + INDEX_SUFFIX))
+                index.write(args.output + INDEX_SUFFIX)
+    metrics.inc('jiradump_rows_written_total', rows_written)
+
+    # Write out any comments and worklogs to their own files.
+    for name, Exporter in SUBRESOURCE_EXPORTERS:
+        if not getattr(args, name):
+            continue
+        info('Writing %s to %s' % (name, getattr(args, name)))
+        with metrics.stage(name):
+            exporter = Exporter(jira, args.delimiter, args.subdelimiter)
+            subresource_output = open_output(getattr(args, name))
+            rows_written = exporter.write(issues, subresource_output,
+                                          args.workers)
+            subresource_output.close()
+        metrics.inc('jiradump_subresource_rows_written_total', rows_written,
+                    resource=name)
+    run_finished[0] = True
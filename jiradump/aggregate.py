@@ -0,0 +1,210 @@
+"""Summarize issues by groups of columns in a single streaming pass.
+
+Only a small running summary is kept for each group, so memory depends on the
+number of groups rather than the number of issues. Percentiles are estimated
+from a fixed size random sample of each group's values.
+"""
+
+from datetime import datetime
+from logging import debug
+import random
+import re
+
+# Number of values sampled per group to estimate percentiles.
+PERCENTILE_SAMPLE_SIZE = 1024
+
+_PERCENTILE = re.compile(r'^p(\d{1,2}(\.\d+)?)$')
+
+AGGREGATE_FUNCTIONS = ('count', 'sum', 'mean', 'min', 'max', 'pNN')
+
+
+def format_value(value, value_type=None):
+    """Format a typed value as unicode for output.
+
+    Numbers are formatted by the type of their column, rather than their own
+    type, so that a column is formatted the same all the way down.
+    """
+    if value is None:
+        return u''
+    if not isinstance(value, (int, long, float)):
+        return unicode(value)
+    if value_type == 'number' or (value_type is None and
+                                  isinstance(value, float)):
+        return unicode('%0.2f' % value)
+    if value_type == 'integer':
+        return unicode('%d' % value)
+    return unicode(value)
+
+
+def result_type(function, column_type):
+    """Return the type of an aggregate's results over a column type."""
+    if function == 'count':
+        return 'integer'
+    if function in ('min', 'max'):
+        return column_type
+    if function == 'sum' and column_type == 'integer':
+        return 'integer'
+    return 'number'
+
+
+class Aggregate(object):
+    """Running summary of one column's values within one group."""
+
+    __slots__ = ('count', 'numbers', 'total', 'minimum', 'maximum', 'sample')
+
+    def __init__(self):
+        self.count = 0
+        self.numbers = 0
+        self.total = 0
+        self.minimum = None
+        self.maximum = None
+        self.sample = []
+
+    def add(self, value, sample, rng):
+        """Add a non-empty value, sampling numbers if asked."""
+        self.count += 1
+        if self.minimum is None or value < self.minimum:
+            self.minimum = value
+        if self.maximum is None or value > self.maximum:
+            self.maximum = value
+        if not isinstance(value, (int, long, float)):
+            return
+        self.numbers += 1
+        self.total += value
+        if not sample:
+            return
+        # Reservoir sampling keeps an even sample of every number seen.
+        if len(self.sample) < PERCENTILE_SAMPLE_SIZE:
+            self.sample.append(value)
+        else:
+            index = rng.randint(0, self.numbers - 1)
+            if index < PERCENTILE_SAMPLE_SIZE:
+                self.sample[index] = value
+
+    def percentile(self, percent):
+        if not self.sample:
+            return None
+        ordered = sorted(self.sample)
+        position = (len(ordered) - 1) * percent / 100.0
+        lower = int(position)
+        upper = min(lower + 1, len(ordered) - 1)
+        return (ordered[lower] +
+                (ordered[upper] - ordered[lower]) * (position - lower))
+
+    def result(self, function):
+        if function == 'count':
+            return self.count
+        if function == 'sum':
+            return self.total
+        if function == 'mean':
+            if not self.numbers:
+                return None
+            return float(self.total) / self.numbers
+        if function == 'min':
+            return self.minimum
+        if function == 'max':
+            return self.maximum
+        return self.percentile(float(_PERCENTILE.match(function).group(1)))
+
+
+def parse_aggregate_spec(spec):
+    """Split a FUNCTION[:COLUMN] aggregate spec into its parts."""
+    function, _, column = spec.partition(':')
+    function = function.lower()
+    if function not in AGGREGATE_FUNCTIONS[:-1] and \
+            not _PERCENTILE.match(function):
+        raise ValueError('Unknown aggregate function: ' + function)
+    if not column and function != 'count':
+        raise ValueError('Aggregate %s needs a column' % function)
+    return function, column
+
+
+def summary_headers(group_by, aggregates, columns=None):
+    """Check a summary's columns and functions, returning its headers.
+
+    columns are the output headers. Leave them out when they can't be known
+    yet, to only check the aggregate functions.
+    """
+    headers = list(group_by)
+    for column in group_by:
+        if columns is not None and column not in columns:
+            raise ValueError('Unknown group by column: ' + column)
+    for spec in aggregates or ['count']:
+        function, column = parse_aggregate_spec(spec)
+        if not column:
+            headers.append(function)
+            continue
+        if columns is not None and column not in columns:
+            raise ValueError('Unknown aggregate column: ' + column)
+        headers.append(u'%s(%s)' % (function, column))
+    return headers
+
+
+class Aggregator(object):
+    """Groups typed rows by some columns and aggregates others.
+
+    Counting without a column counts rows. Counting a column counts its
+    non-empty values. Sums, means and percentiles only consider numbers.
+    """
+
+    def __init__(self, group_by, aggregates, columns, column_types):
+        self.headers = summary_headers(group_by, aggregates, columns)
+        self.group_indexes = [columns.index(column) for column in group_by]
+        self.group_types = [column_types[index]
+                            for index in self.group_indexes]
+        self.functions = []
+        self.result_types = []
+        for spec in aggregates or ['count']:
+            function, column = parse_aggregate_spec(spec)
+            if not column:
+                index = None
+            else:
+                index = columns.index(column)
+                if function in ('sum', 'mean') or \
+                        _PERCENTILE.match(function):
+                    if column_types[index] not in ('number', 'integer'):
+                        debug('Aggregating %s of %s, which may not be '
+                              'numeric.' % (function, column))
+            self.functions.append((function, index))
+            self.result_types.append(result_type(
+                function, None if index is None else column_types[index]))
+        # Summaries are kept per column, so share them between functions.
+        self.aggregate_indexes = sorted(set(index for _, index
+                                            in self.functions))
+        self.sampled_indexes = set(index for function, index in self.functions
+                                   if _PERCENTILE.match(function))
+        self.groups = {}
+        self.rng = random.Random(0)
+
+    def add(self, row):
+        """Add a row of typed values."""
+        key = tuple(row[index] for index in self.group_indexes)
+        group = self.groups.get(key)
+        if group is None:
+            group = self.groups[key] = dict(
+                (index, Aggregate()) for index in self.aggregate_indexes)
+        for index in self.aggregate_indexes:
+            if index is None:
+                group[index].add(1, False, self.rng)
+            elif row[index] is not None:
+                group[index].add(row[index], index in self.sampled_indexes,
+                                 self.rng)
+
+    def rows(self):
+        """Yield a row of UTF-8 values for each group, ordered by group."""
+        debug('Aggregated %s groups.' % len(self.groups))
+
+        def group_order(key):
+            # Empty values sort last, and mixed types can't be compared.
+            return [(value is None, isinstance(value, datetime), value)
+                    for value in key]
+
+        for key in sorted(self.groups, key=group_order):
+            group = self.groups[key]
+            values = [format_value(value, value_type)
+                      for value, value_type in zip(key, self.group_types)]
+            values += [format_value(group[index].result(function),
+                                    value_type)
+                       for (function, index), value_type
+                       in zip(self.functions, self.result_types)]
+            yield [value.encode('utf-8') for value in values]
@@ -0,0 +1,144 @@
+"""Fetch issues by key in batches of concurrent searches.
+
+Keys are chunked into key in (...) searches, small enough to keep clear of
+JIRA's URL and JQL length limits, and the chunks are searched a few at a
+time. Where the JIRA client supports it, query validation is turned off so
+that keys which don't exist are simply left out of the results. Otherwise
+JIRA rejects a whole search if any key in it doesn't exist, so a rejected
+chunk is split in half and each half tried again, until the missing keys are
+found on their own.
+
+Issues which have moved project or been renamed are found by their old keys,
+but come back under their new ones. Chunks with results we didn't ask for
+are split in the same way, until each moved issue is matched up with the key
+it was found by.
+"""
+
+from inspect import getargspec
+from jira.exceptions import JIRAError
+from jiradump.subresources import DEFAULT_WORKERS
+from logging import debug, info, warning
+from multiprocessing.pool import ThreadPool
+import re
+
+# Most keys, and longest JQL, to put in a single search.
+MAX_KEYS_PER_SEARCH = 100
+MAX_JQL_LENGTH = 1500
+
+_ISSUE_KEY = re.compile(r'^[A-Z][A-Z0-9_]*-\d+$')
+
+
+def read_keys(lines):
+    """Return the unique issue keys from the lines, in their original order.
+
+    Blank lines are skipped, and keys are upper cased.
+    """
+    keys = []
+    seen = set()
+    for line in lines:
+        key = line.strip().upper()
+        if key and key not in seen:
+            seen.add(key)
+            keys.append(key)
+    return keys
+
+
+def key_chunks(keys, max_keys=MAX_KEYS_PER_SEARCH,
+               max_length=MAX_JQL_LENGTH):
+    """Split the keys into lists which each make a short enough search."""
+    chunk = []
+    length = len(key_jql([]))
+    for key in keys:
+        if chunk and (len(chunk) >= max_keys or
+                      length + len(key) + 2 > max_length):
+            yield chunk
+            chunk = []
+            length = len(key_jql([]))
+        chunk.append(key)
+        length += len(key) + 2
+    if chunk:
+        yield chunk
+
+
+def key_jql(keys):
+    return 'key in (%s)' % ', '.join(keys)
+
+
+class KeyFetcher(object):
+    """Searches for issues by key, noting any that can't be found."""
+
+    def __init__(self, jira, fields=None, metrics=None):
+        self.jira = jira
+        self.fields = fields
+        self.metrics = metrics
+        self.search_options = {}
+        if 'validate_query' in getargspec(jira.search_issues).args:
+            self.search_options['validate_query'] = False
+
+    def search(self, keys):
+        """Return a dict of the issues found by the keys they were found by.
+
+        Chunks are split when rejected, or when moved issues can't be matched
+        to their old keys.
+        """
+        try:
+            issues = self.jira.search_issues(key_jql(keys),
+                                             maxResults=len(keys),
+                                             fields=self.fields,
+                                             **self.search_options)
+        except JIRAError as err:
+            if getattr(err, 'status_code', None) != 400:
+                raise
+            if len(keys) == 1:
+                debug('Key %s was rejected: %s' % (keys[0], err))
+                return {}
+            return self._split_search(keys)
+        if self.metrics:
+            self.metrics.inc('jiradump_issues_fetched_total', len(issues))
+        found = dict((issue.key, issue) for issue in issues
+                     if issue.key in keys)
+        moved = [issue for issue in issues if issue.key not in keys]
+        if not moved:
+            return found
+        unmatched = [key for key in keys if key not in found]
+        if len(moved) == 1 and len(unmatched) == 1:
+            found[unmatched[0]] = moved[0]
+            return found
+        if len(keys) == 1:
+            return found
+        return self._split_search(keys)
+
+    def _split_search(self, keys):
+        middle = len(keys) // 2
+        found = self.search(keys[:middle])
+        found.update(self.search(keys[middle:]))
+        return found
+
+    def fetch(self, keys, workers=DEFAULT_WORKERS):
+        """Return a dict of the issues found by key, and the missing keys.
+
+        Moved issues are returned under the old keys they were found by.
+        Keys which aren't valid issue keys are never searched for.
+        """
+        valid = [key for key in keys if _ISSUE_KEY.match(key)]
+        chunks = list(key_chunks(valid))
+        info('Searching for %s issue keys in %s batches.' %
+             (len(valid), len(chunks)))
+        found = {}
+        if chunks:
+            pool = ThreadPool(min(workers, len(chunks)))
+            try:
+                for chunk_found in pool.imap_unordered(self.search, chunks):
+                    found.update(chunk_found)
+            finally:
+                pool.close()
+        moved = ['%s is now %s' % (key, found[key].key) for key in keys
+                 if key in found and found[key].key != key]
+        if moved:
+            info('%s issue keys have moved: %s' %
+                 (len(moved), ', '.join(moved)))
+        missing = [key for key in keys if key not in found]
+        if missing:
+            warning('%s issue keys not found: %s' %
+                    (len(missing), ', '.join(missing)))
+        return found, missing
@@ -0,0 +1,281 @@
+"""Columnar binary output, with columns that can be memory mapped.
+
+A columnar dump is a directory holding a manifest.json plus files for each
+column. All numbers are little endian.
+
+* number columns are float64 (<f8), with NaN for empty values.
+* integer columns are int64 (<i8), with -2**63 for empty values.
+* datetime columns are int64 (<i8) microseconds since 1970-01-01, as written
+  in the dump without any timezone, with -2**63 for empty values.
+* string columns are dictionary encoded. An int32 (<i4) code per row indexes
+  the column's distinct values, with -1 for empty values. The distinct
+  values are stored UTF-8 encoded, one after another, in a values blob, with
+  the uint64 (<u8) offsets of each value's start, plus the blob's end, in an
+  offsets file.
+
+The manifest lists each column's name, type, files and numpy style dtypes, so
+columns can be loaded with numpy.memmap, or read with ColumnarDump below.
+"""
+
+from datetime import datetime, timedelta
+from logging import debug, info
+from mmap import mmap, ACCESS_READ
+import dateutil.parser
+import json
+import os
+import struct
+
+NULL_INTEGER = -2 ** 63
+
+MANIFEST = 'manifest.json'
+FORMAT_VERSION = 1
+
+# Fixed width column types: struct format character, numpy dtype, file suffix.
+_FIXED_TYPES = {
+    'number': ('d', '<f8', 'f8'),
+    'integer': ('q', '<i8', 'i8'),
+    'datetime': ('q', '<i8', 'i8'),
+}
+
+# Number of values to gather up before packing them and writing them out.
+_CHUNK_SIZE = 65536
+
+_EPOCH = datetime(1970, 1, 1)
+
+# JIRA field schema types which tell us more than a basic parser's 'string'.
+_SCHEMA_TYPES = {
+    'number': 'number',
+    'date': 'datetime',
+    'datetime': 'datetime',
+}
+
+
+def column_types(parser, schema):
+    """Return the column types for a field from its parser and JIRA schema.
+
+    Parsers know their own types, but the basic parser treats everything as
+    a string, in which case we go by the JIRA field schema.
+    """
+    types = parser.column_types()
+    if types == ['string'] and schema:
+        return [_SCHEMA_TYPES.get(schema.get('type'), 'string')]
+    return types
+
+
+def _to_number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float('nan')
+
+
+def _to_integer(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return NULL_INTEGER
+
+
+def _to_datetime(value):
+    if isinstance(value, basestring):
+        try:
+            value = dateutil.parser.parse(value[:19])
+        except (TypeError, ValueError):
+            return NULL_INTEGER
+    if not isinstance(value, datetime):
+        return NULL_INTEGER
+    delta = value.replace(tzinfo=None) - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 10 ** 6 + delta.microseconds
+
+
+_CONVERTERS = {
+    'number': _to_number,
+    'integer': _to_integer,
+    'datetime': _to_datetime,
+}
+
+
+class _FixedColumnWriter(object):
+    """Writes a column of fixed width values."""
+
+    def __init__(self, directory, index, name, column_type):
+        self.format, self.dtype, suffix = _FIXED_TYPES[column_type]
+        self.convert = _CONVERTERS[column_type]
+        self.manifest = {'name': name, 'type': column_type,
+                         'data': 'c%d.%s' % (index, suffix),
+                         'dtype': self.dtype}
+        self.data = open(os.path.join(directory, self.manifest['data']), 'wb')
+        self.values = []
+
+    def add(self, value):
+        self.values.append(self.convert(value))
+        if len(self.values) >= _CHUNK_SIZE:
+            self._write()
+
+    def _write(self):
+        self.data.write(struct.pack('<%d%s' % (len(self.values), self.format),
+                                    *self.values))
+        self.values = []
+
+    def close(self):
+        self._write()
+        self.data.close()
+        return self.manifest
+
+
+class _StringColumnWriter(object):
+    """Writes a dictionary encoded column of strings."""
+
+    def __init__(self, directory, index, name):
+        self.manifest = {'name': name, 'type': 'string',
+                         'data': 'c%d.i4' % index, 'dtype': '<i4',
+                         'offsets': 'c%d.offsets.u8' % index,
+                         'offsets_dtype': '<u8',
+                         'values': 'c%d.values' % index}
+        self.directory = directory
+        self.data = open(os.path.join(directory, self.manifest['data']), 'wb')
+        self.blob = open(os.path.join(directory, self.manifest['values']),
+                         'wb')
+        self.codes = []
+        self.dictionary = {}
+        self.offsets = [0]
+
+    def add(self, value):
+        if value is None:
+            code = -1
+        else:
+            value = unicode(value)
+            code = self.dictionary.get(value)
+            if code is None:
+                code = self.dictionary[value] = len(self.dictionary)
+                encoded = value.encode('utf-8')
+                self.blob.write(encoded)
+                self.offsets.append(self.offsets[-1] + len(encoded))
+        self.codes.append(code)
+        if len(self.codes) >= _CHUNK_SIZE:
+            self._write()
+
+    def _write(self):
+        self.data.write(struct.pack('<%di' % len(self.codes), *self.codes))
+        self.codes = []
+
+    def close(self):
+        self._write()
+        self.data.close()
+        self.blob.close()
+        with open(os.path.join(self.directory, self.manifest['offsets']),
+                  'wb') as offsets:
+            offsets.write(struct.pack('<%dQ' % len(self.offsets),
+                                      *self.offsets))
+        self.manifest['distinct'] = len(self.dictionary)
+        return self.manifest
+
+
+class ColumnarWriter(object):
+    """Writes rows of typed values as a columnar dump directory."""
+
+    def __init__(self, directory, columns, types):
+        info('Writing columnar output to %s' % directory)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.rows = 0
+        self.columns = []
+        for index, (name, column_type) in enumerate(zip(columns, types)):
+            debug('Column %s is %s.' % (name, column_type))
+            if column_type == 'string':
+                column = _StringColumnWriter(directory, index, name)
+            else:
+                column = _FixedColumnWriter(directory, index, name,
+                                            column_type)
+            self.columns.append(column)
+
+    def add(self, row):
+        for column, value in zip(self.columns, row):
+            column.add(value)
+        self.rows += 1
+
+    def close(self):
+        """Finish the column files and write the manifest."""
+        manifest = {'version': FORMAT_VERSION, 'rows': self.rows,
+                    'columns': [column.close() for column in self.columns]}
+        with open(os.path.join(self.directory, MANIFEST), 'w') as output:
+            json.dump(manifest, output, indent=2, sort_keys=True)
+
+
+class Column(object):
+    """Read only view of a memory mapped column.
+
+    Values are unpacked straight from the mapped file as they are indexed,
+    without reading the column into memory. buffer is the mapped data itself,
+    e.g. for numpy.frombuffer(column.buffer, column.dtype).
+    """
+
+    def __init__(self, directory, manifest, rows):
+        self.name = manifest['name']
+        self.type = manifest['type']
+        self.dtype = manifest['dtype']
+        self.rows = rows
+        self.buffer = self._map(directory, manifest['data'])
+        self.width = struct.calcsize('<' + self._format())
+        if self.type == 'string':
+            self.offsets = self._map(directory, manifest['offsets'])
+            self.values = self._map(directory, manifest['values'])
+
+    @staticmethod
+    def _map(directory, filename):
+        with open(os.path.join(directory, filename), 'rb') as mapped:
+            if not os.fstat(mapped.fileno()).st_size:
+                return ''
+            return mmap(mapped.fileno(), 0, access=ACCESS_READ)
+
+    def _format(self):
+        if self.type == 'string':
+            return 'i'
+        return _FIXED_TYPES[self.type][0]
+
+    def __len__(self):
+        return self.rows
+
+    def raw(self, index):
+        """Return the stored number or code at the index, unconverted."""
+        if not 0 <= index < self.rows:
+            raise IndexError(index)
+        return struct.unpack_from('<' + self._format(), self.buffer,
+                                  index * self.width)[0]
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.rows
+        value = self.raw(index)
+        if self.type == 'string':
+            if value < 0:
+                return None
+            start, end = struct.unpack_from('<QQ', self.offsets, value * 8)
+            return self.values[start:end].decode('utf-8')
+        if self.type == 'number':
+            return None if value != value else value
+        if value == NULL_INTEGER:
+            return None
+        if self.type == 'datetime':
+            return _EPOCH + timedelta(microseconds=value)
+        return value
+
+
+class ColumnarDump(object):
+    """Opens a columnar dump directory for reading."""
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, MANIFEST)) as manifest:
+            self.manifest = json.load(manifest)
+        self.rows = self.manifest['rows']
+        self.columns = [Column(directory, column, self.rows)
+                        for column in self.manifest['columns']]
+        self._by_name = dict((column.name, column)
+                             for column in self.columns)
+
+    def __getitem__(self, name):
+        return self._by_name[name]
+
+    def __len__(self):
+        return self.rows
@@ -0,0 +1,173 @@
+"""Follow a filter, picking up new and changed issues as they happen.
+
+Rather than searching the whole filter again each time, each poll only asks
+for issues updated since the last change seen. JQL only compares updated
+times to the minute, so each poll overlaps the last a little, and issues we
+have already seen at the same updated time are skipped.
+
+Each poll pages through its results by moving the cursor on to the last
+updated time of each page, rather than by offset. Issues updated during a
+poll move to the end of the results, so paging by offset would skip over
+whichever issue moved into its place. Only when a whole page shares one
+minute, so the cursor can't move, do we fall back to paging by offset.
+"""
+
+from jira.exceptions import JIRAError
+from logging import info, warning
+from requests.exceptions import ConnectionError
+import re
+import time
+
+DEFAULT_POLL_INTERVAL = 30
+DEFAULT_MAX_POLL_INTERVAL = 600
+
+# Responses telling us the server wants us to back off.
+BACK_PRESSURE_STATUSES = (429, 502, 503, 504)
+
+# Change types tagged on each row.
+NEW = 'new'
+CHANGED = 'changed'
+
+# Quoted strings, so we can skip over them, and the ORDER BY clause.
+_JQL_TOKENS = re.compile(r'"(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\'|'
+                         r'\border\s+by\b', re.IGNORECASE)
+
+
+def _strip_order_by(jql):
+    """Remove any ORDER BY clause from the JQL, ignoring quoted strings."""
+    for match in _JQL_TOKENS.finditer(jql):
+        if match.group(0)[0] not in '"\'':
+            return jql[:match.start()].strip()
+    return jql.strip()
+
+
+def _cursor(updated):
+    """Convert an updated time to a JQL time, to the minute.
+
+    e.g. 2013-06-04T15:15:36.000-0400 to 2013/06/04 15:15
+    """
+    return updated[:16].replace('-', '/').replace('T', ' ')
+
+
+def _retry_after(err):
+    """Return the seconds a throttled response asked us to wait, if any."""
+    response = getattr(err, 'response', None)
+    headers = getattr(response, 'headers', None) or \
+        getattr(err, 'headers', None) or {}
+    try:
+        return float(headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+class Follower(object):
+    """Polls a filter's JQL for issues updated since the last poll.
+
+    The time between polls halves while issues keep changing, and grows
+    while they don't, within the given bounds. Slow responses and throttling
+    from the server stretch it out further.
+    """
+
+    def __init__(self, jira, jql, max_results, metrics, search_fields=None,
+                 min_interval=DEFAULT_POLL_INTERVAL,
+                 max_interval=DEFAULT_MAX_POLL_INTERVAL):
+        self.jira = jira
+        self.jql = _strip_order_by(jql)
+        self.max_results = int(max_results)
+        self.metrics = metrics
+        self.search_fields = search_fields
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.interval = min_interval
+        self.cursor = None
+        self.seen = {}
+
+    def _jql(self, cursor):
+        jql = self.jql
+        if cursor:
+            jql = '(%s) AND updated >= "%s"' % (jql, cursor) \
+                if jql else 'updated >= "%s"' % cursor
+        return jql + ' ORDER BY updated ASC'
+
+    def _search(self):
+        """Return every issue updated since the cursor, a page at a time."""
+        issues = []
+        found = set()
+        cursor = self.cursor
+        start = 0
+        while True:
+            page = self.jira.search_issues(self._jql(cursor), startAt=start,
+                                           maxResults=self.max_results,
+                                           fields=self.search_fields)
+            # Pages overlap at the minute they start from, so skip issues
+            # already found at the same updated time.
+            for issue in page:
+                updated = getattr(issue.fields, 'updated', None)
+                if (issue.key, updated) not in found:
+                    found.add((issue.key, updated))
+                    issues.append(issue)
+            if len(page) < self.max_results:
+                return issues
+            updated = getattr(page[-1].fields, 'updated', None)
+            last = _cursor(updated) if updated else cursor
+            if last == cursor:
+                # The whole page is in the cursor's minute.
+                start += len(page)
+            else:
+                cursor = last
+                start = 0
+
+    def poll(self):
+        """Search once, returning a list of (change type, issue) pairs."""
+        start = time.time()
+        issues = self._search()
+        elapsed = time.time() - start
+        self.metrics.inc('jiradump_issues_fetched_total', len(issues))
+
+        changes = []
+        for issue in issues:
+            updated = getattr(issue.fields, 'updated', None)
+            if issue.key in self.seen and self.seen[issue.key] == updated:
+                continue
+            changes.append((CHANGED if issue.key in self.seen else NEW,
+                            issue))
+            self.seen[issue.key] = updated
+            if updated:
+                cursor = _cursor(updated)
+                if self.cursor is None or cursor > self.cursor:
+                    self.cursor = cursor
+
+        # Poll more often while things are changing, and back off while they
+        # aren't, or the server is struggling to keep up.
+        if changes:
+            self.interval = max(self.min_interval, self.interval / 2.0)
+        else:
+            self.interval = min(self.max_interval, self.interval * 1.5)
+        self.interval = min(self.max_interval,
+                            max(self.interval, elapsed * 10))
+        info('Found %s new or changed issues in %0.2f seconds. Polling '
+             'again in %0.0f seconds.' % (len(changes), elapsed,
+                                          self.interval))
+        return changes
+
+    def changes(self):
+        """Yield the changes found by each poll, forever, waiting between.
+
+        Throttling and server errors back off and try again.
+        """
+        while True:
+            time.sleep(self.interval)
+            try:
+                yield self.poll()
+            except (JIRAError, ConnectionError) as err:
+                status = getattr(err, 'status_code', None)
+                if isinstance(err, JIRAError) and \
+                        status not in BACK_PRESSURE_STATUSES:
+                    raise
+                self.metrics.inc('jiradump_api_retries_total',
+                                 endpoint='search')
+                self.interval = max(min(self.max_interval,
+                                        self.interval * 2),
+                                    _retry_after(err) or 0)
+                warning('Backing off for %0.0f seconds after: %s' %
+                        (self.interval, err))
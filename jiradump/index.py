@@ -0,0 +1,145 @@
+"""Sorted key index sidecar files for random access into dump files.
+
+An index maps each issue key to the byte offset and length of its row in an
+uncompressed dump. It is a small header followed by fixed width records
+sorted by key, so it can be memory mapped and binary searched without reading
+it all in.
+
+The header is the magic string JDIX, a uint16 format version, the uint16 key
+width and the uint64 record count. Each record is the key, NUL padded to the
+key width, then the row's uint64 offset and uint32 length. All numbers are
+little endian.
+"""
+
+from mmap import mmap, ACCESS_READ
+import argparse
+import struct
+import sys
+
+MAGIC = 'JDIX'
+FORMAT_VERSION = 1
+INDEX_SUFFIX = '.idx'
+
+_HEADER = struct.Struct('<4sHHQ')
+
+
+def _record(key_width):
+    return struct.Struct('<%dsQI' % key_width)
+
+
+class IndexBuilder(object):
+    """Collects the position of each row and writes them out as an index."""
+
+    def __init__(self):
+        self.entries = []
+
+    def add(self, key, offset, length):
+        self.entries.append((key, offset, length))
+
+    def write(self, filename):
+        self.entries.sort()
+        key_width = max([len(key) for key, _, _ in self.entries] or [0])
+        record = _record(key_width)
+        with open(filename, 'wb') as index:
+            index.write(_HEADER.pack(MAGIC, FORMAT_VERSION, key_width,
+                                     len(self.entries)))
+            for entry in self.entries:
+                index.write(record.pack(*entry))
+
+
+class KeyIndex(object):
+    """Looks up rows in a dump file through its memory mapped index."""
+
+    def __init__(self, filename):
+        with open(filename, 'rb') as index:
+            self.map = mmap(index.fileno(), 0, access=ACCESS_READ)
+        magic, version, self.key_width, self.count = \
+            _HEADER.unpack_from(self.map)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError('Not a jiradump index: ' + filename)
+        self.record = _record(self.key_width)
+
+    def __len__(self):
+        return self.count
+
+    def _entry(self, position):
+        key, offset, length = self.record.unpack_from(
+            self.map, _HEADER.size + position * self.record.size)
+        return key.rstrip('\0'), offset, length
+
+    def lookup(self, key):
+        """Return the offset and length of the key's row, or None."""
+        if len(key) > self.key_width:
+            return None
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._entry(middle)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count:
+            found, offset, length = self._entry(low)
+            if found == key:
+                return offset, length
+        return None
+
+    def read_row(self, dump_filename, key):
+        """Return the key's row from the dump file, or None."""
+        position = self.lookup(key)
+        if position is None:
+            return None
+        offset, length = position
+        with open(dump_filename, 'rb') as dump:
+            dump.seek(offset)
+            return dump.read(length)
+
+    def patch_row(self, dump_filename, key, row):
+        """Overwrite the key's row in the dump file in place.
+
+        The new row must be exactly as long as the old one, so that no other
+        rows move.
+        """
+        position = self.lookup(key)
+        if position is None:
+            raise KeyError(key)
+        offset, length = position
+        if len(row) != length:
+            raise ValueError('Patched row for %s must be %s bytes, not %s' %
+                             (key, length, len(row)))
+        with open(dump_filename, 'r+b') as dump:
+            dump.seek(offset)
+            dump.write(row)
+
+
+def build_parser():
+    """Build a command line argument parser for index lookups."""
+    parser = argparse.ArgumentParser(description='look up issue rows in a '
+                                     'jiradump output file by key')
+    parser.add_argument('-i', '--index', nargs='?', help='specify index '
+                        'filename. Defaults to the dump filename plus ' +
+                        INDEX_SUFFIX)
+    parser.add_argument('dump', metavar='DUMP', help='specifies the dump '
+                        'file written with --index')
+    parser.add_argument('keys', metavar='KEY', nargs='+', help='specifies '
+                        'the issue keys to look up')
+    return parser
+
+
+def main():
+    """Write out the rows for each key, warning about any not found."""
+    args = build_parser().parse_args()
+    index = KeyIndex(args.index or args.dump + INDEX_SUFFIX)
+    missing = False
+    for key in args.keys:
+        row = index.read_row(args.dump, key)
+        if row is None:
+            sys.stderr.write('Key not found: %s\n' % key)
+            missing = True
+        else:
+            sys.stdout.write(row + '\n')
+    sys.exit(1 if missing else 0)
+
+
+if __name__ == '__main__':
+    main()
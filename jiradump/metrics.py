@@ -0,0 +1,303 @@
+"""Operational metrics for a jiradump run.
+
+Metrics are collected for every run and can be exported as a Prometheus
+textfile collector file and/or as StatsD UDP packets. The metric names below
+are part of jiradump's interface; keep them stable so alerts keep working.
+"""
+
+from bisect import bisect_left
+from contextlib import contextmanager
+from jiradump.transport import ForwardingAdapter
+from logging import debug, warning
+from threading import Lock
+from urlparse import urlparse
+import os
+import re
+import socket
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Metric names, their Prometheus types and help text.
+METRICS = {
+    'jiradump_api_requests_total':
+        ('counter', 'JIRA API HTTP requests made, by endpoint.'),
+    'jiradump_api_response_seconds':
+        ('histogram', 'JIRA API response latency in seconds, by endpoint.'),
+    'jiradump_api_response_bytes_total':
+        ('counter', 'Bytes received in JIRA API response bodies.'),
+    'jiradump_api_retries_total':
+        ('counter', 'JIRA API requests which failed in a way that is '
+         'retried, i.e. connection errors, throttling and unavailability.'),
+    'jiradump_issues_fetched_total':
+        ('counter', 'Issues fetched from JIRA.'),
+    'jiradump_rows_written_total':
+        ('counter', 'Issue rows written to the output.'),
+    'jiradump_subresource_rows_written_total':
+        ('counter', 'Comment and worklog rows written, by resource.'),
+    'jiradump_rows_per_second':
+        ('gauge', 'Issue rows written per second of the write stage.'),
+    'jiradump_peak_rss_bytes':
+        ('gauge', 'Peak resident set size of the process.'),
+    'jiradump_stage_duration_seconds':
+        ('gauge', 'Wall clock time spent in each stage of the run.'),
+    'jiradump_run_success':
+        ('gauge', '1 if the run finished successfully, otherwise 0.'),
+    'jiradump_last_run_timestamp_seconds':
+        ('gauge', 'Unix time the run finished.'),
+}
+
+# Upper bounds of the latency histogram buckets, in seconds.
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# HTTP status codes the JIRA client's session retries.
+RETRY_STATUSES = (429, 502, 503, 504)
+
+# Path segments which identify a single resource, collapsed so that
+# endpoints are labelled by kind rather than by issue or filter.
+_ID_SEGMENT = re.compile(r'^\d+$')
+_KEY_SEGMENT = re.compile(r'^[A-Za-z][A-Za-z0-9_]*-\d+$')
+
+# Keep StatsD packets small enough to never be fragmented.
+_MAX_PACKET_SIZE = 512
+
+DEFAULT_STATSD_PORT = 8125
+
+
+def statsd_address(address):
+    """Split a HOST[:PORT] StatsD address into its host and port.
+
+    The host defaults to localhost and the port to 8125. Raises ValueError if
+    the port isn't a number.
+    """
+    host, _, port = address.partition(':')
+    return host or 'localhost', int(port or DEFAULT_STATSD_PORT)
+
+
+def endpoint_name(url):
+    """Return a short, low cardinality label for a JIRA REST API URL.
+
+    e.g. https://jira.example.com/rest/api/2/issue/ABC-123/comment becomes
+    issue/{key}/comment
+    """
+    path = urlparse(url).path
+    path = re.sub(r'^.*?/rest/(api/[^/]+/)?', '', path).strip('/')
+    segments = []
+    for segment in path.split('/'):
+        if _ID_SEGMENT.match(segment):
+            segment = '{id}'
+        elif _KEY_SEGMENT.match(segment):
+            segment = '{key}'
+        segments.append(segment)
+    return '/'.join(segments) or 'unknown'
+
+
+def peak_rss_bytes():
+    """Return the peak resident set size of this process, if known."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, but OS X reports bytes.
+    if sys.platform != 'darwin':
+        peak *= 1024
+    return peak
+
+
+class Metrics(object):
+    """Thread safe collection of counters, gauges and histograms.
+
+    Each metric is keyed by name plus a sorted tuple of label pairs.
+    """
+
+    def __init__(self, statsd=None):
+        self.statsd = statsd
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self._lock = Lock()
+
+    def inc(self, name, value=1, **labels):
+        """Add the value to a counter."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        """Set a gauge to the value."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.gauges[key] = value
+
+    def observe(self, name, value, **labels):
+        """Record a latency, in seconds, in a histogram."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = [[0] * (len(LATENCY_BUCKETS) + 1),
+                                        0.0, 0]
+            buckets, total, count = self.histograms[key]
+            buckets[bisect_left(LATENCY_BUCKETS, value)] += 1
+            self.histograms[key][1:] = [total + value, count + 1]
+        if self.statsd:
+            self.statsd.timing(name, value, labels)
+
+    def get(self, name, **labels):
+        """Return the current value of a counter or gauge."""
+        key = (name, tuple(sorted(labels.items())))
+        return self.counters.get(key, self.gauges.get(key, 0))
+
+    @contextmanager
+    def stage(self, name):
+        """Time the enclosed block as a named stage of the run."""
+        start = time.time()
+        try:
+            yield
+        finally:
+            duration = time.time() - start
+            debug('Stage %s took %0.3f seconds.' % (name, duration))
+            self.set('jiradump_stage_duration_seconds', duration, stage=name)
+
+    def finish(self, success):
+        """Record the run summary metrics."""
+        rows = self.get('jiradump_rows_written_total')
+        duration = self.get('jiradump_stage_duration_seconds', stage='write')
+        if duration:
+            self.set('jiradump_rows_per_second', rows / duration)
+        peak = peak_rss_bytes()
+        if peak is not None:
+            self.set('jiradump_peak_rss_bytes', peak)
+        self.set('jiradump_run_success', 1 if success else 0)
+        self.set('jiradump_last_run_timestamp_seconds', time.time())
+
+    def prometheus_lines(self):
+        """Return the metrics in the Prometheus text exposition format."""
+        samples = {}
+        for (name, labels), value in self.counters.items():
+            samples.setdefault(name, []).append((name, labels, value))
+        for (name, labels), value in self.gauges.items():
+            samples.setdefault(name, []).append((name, labels, value))
+        for (name, labels), (buckets, total, count) in \
+                self.histograms.items():
+            cumulative = 0
+            for bound, bucket in zip(LATENCY_BUCKETS + ('+Inf',), buckets):
+                cumulative += bucket
+                samples.setdefault(name, []).append(
+                    (name + '_bucket', labels + (('le', str(bound)),),
+                     cumulative))
+            samples[name].append((name + '_sum', labels, total))
+            samples[name].append((name + '_count', labels, count))
+
+        lines = []
+        for name in sorted(samples):
+            kind, help_text = METRICS.get(name, ('untyped', name))
+            lines.append('# HELP %s %s' % (name, help_text))
+            lines.append('# TYPE %s %s' % (name, kind))
+            # Histogram buckets are already in order of their bounds.
+            if kind != 'histogram':
+                samples[name].sort()
+            for sample, labels, value in samples[name]:
+                if labels:
+                    sample += '{%s}' % ','.join(
+                        '%s="%s"' % (label, str(label_value).replace(
+                            '\\', '\\\\').replace('"', '\\"'))
+                        for label, label_value in labels)
+                lines.append('%s %r' % (sample, float(value)))
+        return lines
+
+    def write_textfile(self, filename):
+        """Atomically write the metrics for a Prometheus textfile collector."""
+        debug('Writing metrics to %s' % filename)
+        temp_filename = '%s.%s.tmp' % (filename, os.getpid())
+        with open(temp_filename, 'w') as metrics_file:
+            metrics_file.write('\n'.join(self.prometheus_lines()) + '\n')
+        os.rename(temp_filename, filename)
+
+    def send_statsd(self):
+        """Send the counters and gauges to StatsD.
+
+        Histogram observations are sent as timings as they happen.
+        """
+        if not self.statsd:
+            return
+        for (name, labels), value in self.counters.items():
+            self.statsd.send(name, value, 'c', dict(labels))
+        for (name, labels), value in self.gauges.items():
+            self.statsd.send(name, value, 'g', dict(labels))
+        self.statsd.flush()
+
+
+class StatsdClient(object):
+    """Minimal StatsD client sending batched UDP packets.
+
+    Metric jiradump_api_requests_total{endpoint="search"} is sent as
+    jiradump.api_requests_total.search
+
+    address is a (host, port) pair, as returned by statsd_address().
+    """
+
+    def __init__(self, address):
+        self.address = address
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._lines = []
+        self._lock = Lock()
+
+    @staticmethod
+    def metric_name(name, labels):
+        parts = [re.sub(r'^jiradump_', 'jiradump.', name)]
+        for label in sorted(labels):
+            parts.append(re.sub(r'[^A-Za-z0-9_-]', '_',
+                                str(labels[label])) or '_')
+        return '.'.join(parts)
+
+    def timing(self, name, seconds, labels):
+        self.send(name, int(round(seconds * 1000)), 'ms', labels)
+
+    def send(self, name, value, kind, labels):
+        line = '%s:%s|%s' % (self.metric_name(name, labels), value, kind)
+        with self._lock:
+            if sum(len(l) + 1 for l in self._lines) + len(line) > \
+                    _MAX_PACKET_SIZE:
+                self._flush()
+            self._lines.append(line)
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if not self._lines:
+            return
+        try:
+            self.socket.sendto('\n'.join(self._lines), self.address)
+        except socket.error as err:
+            warning('Failed to send metrics to StatsD: %s' % err)
+        self._lines = []
+
+
+class MetricsAdapter(ForwardingAdapter):
+    """Counts and times every HTTP request the JIRA client makes."""
+
+    def __init__(self, adapter, metrics):
+        ForwardingAdapter.__init__(self, adapter)
+        self.metrics = metrics
+
+    def send(self, request, **kwargs):
+        endpoint = endpoint_name(request.url)
+        self.metrics.inc('jiradump_api_requests_total', endpoint=endpoint)
+        start = time.time()
+        try:
+            response = self.adapter.send(request, **kwargs)
+        except Exception:
+            self.metrics.inc('jiradump_api_retries_total', endpoint=endpoint)
+            raise
+        self.metrics.observe('jiradump_api_response_seconds',
+                             time.time() - start, endpoint=endpoint)
+        self.metrics.inc('jiradump_api_response_bytes_total',
+                         len(response.content or ''), endpoint=endpoint)
+        if response.status_code in RETRY_STATUSES:
+            self.metrics.inc('jiradump_api_retries_total', endpoint=endpoint)
+        return response
@@ -11,6 +11,14 @@ class BasicFieldParser(object):
     a delimited string.
     """
 
+    # The type of value in each output column, one of 'string', 'number',
+    # 'integer' or 'datetime'.
+    column_type = 'string'
+
+    # Whether the field splits into columns which depend on the issues, so
+    # its headers aren't known until the issues have been fetched.
+    split_columns = False
+
     def __init__(self, field_name, issues, jira, delimiter):
         """Handle any initial setup for the given issue set."""
         self.field_name = unicode(field_name)
@@ -25,6 +33,10 @@ class BasicFieldParser(object):
         """
         return [unicode(self.field_name)]
 
+    def column_types(self):
+        """Return an ordered list of the value types of each output column."""
+        return [self.column_type] * len(self.headers())
+
     def _parse_one_value(self, raw_value):
         """Parse a single value.
 
@@ -57,6 +69,29 @@ class BasicFieldParser(object):
         return [self.delimiter.join([self._parse_one_value(value)
                                      for value in raw_values])]
 
+    def _typed_one_value(self, raw_value):
+        """Convert a single value to a typed value, or None if empty.
+
+        Basic fields keep numbers as numbers and everything else as unicode.
+        """
+        if (isinstance(raw_value, (int, long, float)) and
+                not isinstance(raw_value, bool)):
+            return raw_value
+        return self._parse_one_value(raw_value) or None
+
+    def parse_typed(self, raw_values):
+        """Return an ordered list of the parsed values as typed values.
+
+        This matches parse_values(), but with numbers, datetimes and so on
+        instead of unicode, and None for empty values. Multiple values are
+        still joined into a single delimited string.
+        """
+        if (isinstance(raw_values, basestring) or
+                not isinstance(raw_values, Iterable)):
+            return [self._typed_one_value(raw_values)]
+
+        return [self.parse_values(raw_values)[0] or None]
+
 
 class SecondsDurationParser(BasicFieldParser):
     """Converts durations stored as seconds into decimal days.
@@ -66,6 +101,8 @@ class SecondsDurationParser(BasicFieldParser):
 
     """
 
+    column_type = 'number'
+
     def _parse_one_value(self, raw_value):
         """Converts seconds to decimal days to two places."""
 
@@ -79,6 +116,13 @@ class SecondsDurationParser(BasicFieldParser):
         else:
             return u''
 
+    def _typed_one_value(self, raw_value):
+        """Converts seconds to decimal days."""
+        try:
+            return float(raw_value) / (60 * 60 * 24) if raw_value else None
+        except ValueError:
+            return None
+
 
 class DateTimeFieldParser(BasicFieldParser):
     """Converts JIRA's ISO style date times in more spreadsheet friendly form.
@@ -86,6 +130,8 @@ class DateTimeFieldParser(BasicFieldParser):
     e.g. 2013-06-04T15:15:36.000-0400 to 2013-06-04 15:15:36
     """
 
+    column_type = 'datetime'
+
     def _parse_one_value(self, raw_value):
         """Parse the ISO style datetime values into a spreadsheet friendly
         format.
@@ -102,6 +148,13 @@ class DateTimeFieldParser(BasicFieldParser):
         else:
             return u''
 
+    def _typed_one_value(self, raw_value):
+        """Parse the ISO style datetime values into naive datetimes."""
+        try:
+            return dateutil.parser.parse(raw_value[:19]) if raw_value else None
+        except (TypeError, ValueError):
+            return None
+
 
 class TimeInStatusFieldParser(BasicFieldParser):
     """Parse the crazy custom Time in Status field into multple columns."""
@@ -113,6 +166,8 @@ class TimeInStatusFieldParser(BasicFieldParser):
     FIRST_STATUSES = ['Open']
     LAST_STATUSES = ['Closed']
 
+    split_columns = True
+
     def __init__(self, field_name, issues, jira, delimiter):
         """Scan the issues to see which status codes exist in these issues.
 
@@ -154,6 +209,8 @@ class TimeInStatusFieldParser(BasicFieldParser):
                 postfix.append(status)
         # Build the ordered list of statuses.
         self.statuses = prefix + sorted(list(statuses)) + postfix
+        # Statuses found later, which have no columns of their own.
+        self.unlisted = set()
 
         # Call the super init to be safe.
         BasicFieldParser.__init__(self, field_name, issues, jira, delimiter)
@@ -164,6 +221,9 @@ class TimeInStatusFieldParser(BasicFieldParser):
             headers += [status + u' Count', status + u' Days']
         return headers
 
+    def column_types(self):
+        return ['integer', 'number'] * len(self.statuses)
+
     def _parse_time_in_status(self, raw_time_in_status):
         """Split the time in status raw into a readable dict.
 
@@ -199,6 +259,19 @@ class TimeInStatusFieldParser(BasicFieldParser):
 
         return status_times
 
+    def _listed_status_times(self, raw_time_in_status):
+        """Parse the time in status, warning once about each status that
+        wasn't in the issues the columns were chosen from.
+        """
+        status_times = self._parse_time_in_status(raw_time_in_status)
+        for status in status_times:
+            if status not in self.statuses and status not in self.unlisted:
+                warning('Leaving out Time in Status for %s, which has no '
+                        'columns as no issue was in it when they were '
+                        'chosen.' % status)
+                self.unlisted.add(status)
+        return status_times
+
     def _parse_one_value(self, raw_value):
         """This should never be called on parsers that split values into
         multiple columns.
@@ -231,7 +304,7 @@ class TimeInStatusFieldParser(BasicFieldParser):
         if not raw_values:
             return [u''] * (len(self.statuses) * 2)
 
-        status_times = self._parse_time_in_status(raw_values)
+        status_times = self._listed_status_times(raw_values)
         parsed_values = []
         for status in self.statuses:
             # If there is entry for this status, add on two blank columns.
@@ -247,3 +320,20 @@ class TimeInStatusFieldParser(BasicFieldParser):
             duration = unicode('%0.2f' % (duration / (60 * 60 * 24)))
             parsed_values += [count, duration]
         return parsed_values
+
+    def parse_typed(self, raw_values):
+        """Split the time in status into a count and decimal days per status.
+        """
+        if not raw_values:
+            return [None] * (len(self.statuses) * 2)
+
+        status_times = self._listed_status_times(raw_values)
+        typed_values = []
+        for status in self.statuses:
+            if status not in status_times:
+                typed_values += [None, None]
+                continue
+            duration = status_times[status]['duration'].total_seconds()
+            typed_values += [status_times[status]['count'],
+                             duration / (60 * 60 * 24)]
+        return typed_values
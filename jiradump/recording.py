@@ -0,0 +1,126 @@
+"""Record JIRA API responses to an archive and replay them without a network.
+
+The archive is a gzipped file of JSON lines, one per response, in the order
+they were received. Responses are matched up for replay by method, path and
+query string, so an archive recorded against one server can be replayed with
+any --jira setting.
+"""
+
+from base64 import b64decode, b64encode
+from collections import deque
+from jiradump.transport import ForwardingAdapter
+from logging import debug, info
+from requests.adapters import BaseAdapter
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+from threading import Lock
+from urllib import urlencode
+from urlparse import parse_qsl, urlparse
+import gzip
+import json
+
+# Response headers which no longer apply to the decoded body we save, or
+# which we would rather not keep around on disk.
+_SKIPPED_HEADERS = ('content-encoding', 'content-length', 'transfer-encoding',
+                    'set-cookie')
+
+
+class ReplayError(Exception):
+    """Raised when a request has no recorded response to replay."""
+
+
+def request_key(method, url):
+    """Return the key to match a request with its recorded response."""
+    parsed = urlparse(url)
+    query = sorted(parse_qsl(parsed.query, keep_blank_values=True))
+    return '%s %s?%s' % (method.upper(), parsed.path, urlencode(query))
+
+
+class ResponseRecorder(object):
+    """Appends responses to an archive as they are received."""
+
+    def __init__(self, filename):
+        info('Recording JIRA API responses to %s' % filename)
+        self.archive = gzip.open(filename, 'wb')
+        self._lock = Lock()
+
+    def record(self, request, response):
+        body = response.content or ''
+        entry = {
+            'key': request_key(request.method, request.url),
+            'status': response.status_code,
+            'reason': response.reason,
+            'encoding': response.encoding,
+            'headers': dict((name, value) for name, value
+                            in response.headers.items()
+                            if name.lower() not in _SKIPPED_HEADERS),
+        }
+        try:
+            entry['body'] = body.decode('utf-8')
+        except UnicodeDecodeError:
+            entry['body64'] = b64encode(body)
+        line = json.dumps(entry, separators=(',', ':')) + '\n'
+        with self._lock:
+            self.archive.write(line)
+
+    def close(self):
+        with self._lock:
+            if not self.archive.closed:
+                self.archive.close()
+
+
+class RecordingAdapter(ForwardingAdapter):
+    """Saves every response passed back through the adapter."""
+
+    def __init__(self, adapter, recorder):
+        ForwardingAdapter.__init__(self, adapter)
+        self.recorder = recorder
+
+    def send(self, request, **kwargs):
+        response = self.adapter.send(request, **kwargs)
+        self.recorder.record(request, response)
+        return response
+
+
+class ReplayAdapter(BaseAdapter):
+    """Answers requests from a recorded archive instead of the network.
+
+    Repeated requests get their recorded responses in order, with the last
+    one reused once they run out.
+    """
+
+    def __init__(self, filename):
+        BaseAdapter.__init__(self)
+        info('Replaying JIRA API responses from %s' % filename)
+        self.responses = {}
+        with gzip.open(filename, 'rb') as archive:
+            for line in archive:
+                entry = json.loads(line)
+                self.responses.setdefault(entry['key'], deque()).append(entry)
+        self._lock = Lock()
+
+    def send(self, request, **kwargs):
+        key = request_key(request.method, request.url)
+        debug('Replaying ' + key)
+        with self._lock:
+            entries = self.responses.get(key)
+            if not entries:
+                raise ReplayError('No recorded response for ' + key)
+            entry = entries.popleft() if len(entries) > 1 else entries[0]
+
+        response = Response()
+        response.status_code = entry['status']
+        response.reason = entry['reason']
+        response.encoding = entry['encoding']
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        if 'body64' in entry:
+            response._content = b64decode(entry['body64'])
+        else:
+            response._content = entry['body'].encode('utf-8')
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        return response
+
+    def close(self):
+        pass
@@ -0,0 +1,231 @@
+"""Columns taken from related issues, such as Parent.Summary or Epic.Status.
+
+A related column is named for the relation and a field of the related issue.
+The relations are:
+
+* Parent, the parent of a sub-task.
+* Epic, the issue named in the Epic Link field.
+* Sub-tasks, all of an issue's sub-tasks. Number fields are summed, and other
+  fields are joined with the sub-delimiter. Sub-tasks.Count counts them.
+
+Looking up related issues one at a time would cost a request per issue, so
+instead every related key in a batch of issues is gathered up and the ones we
+don't already have are fetched with a few batched searches, and kept for the
+rest of the run. Issues in the batch itself are kept too, as they are often
+related to each other. JIRA includes a few fields of parents and sub-tasks,
+such as the summary and status, with the issue itself, so those never need
+fetching at all.
+
+Since related issues are kept, changes to them later in the run aren't picked
+up. When following a filter, an issue's Epic.Status, say, stays as it was
+when the epic was first fetched, unless the epic is itself in the filter and
+changes.
+"""
+
+from jiradump.bulk import KeyFetcher
+from jiradump.columnar import column_types
+from jiradump.parsers import BasicFieldParser
+from jiradump.subresources import DEFAULT_WORKERS
+from logging import debug, info
+
+# Relation names, and the ID of the field on an issue which holds them. The
+# Epic Link field is a custom field, so its ID is looked up by name.
+RELATIONS = {
+    'Parent': 'parent',
+    'Epic': None,
+    'Sub-tasks': 'subtasks',
+}
+EPIC_LINK_FIELD = 'Epic Link'
+
+# Sub-tasks.Count is the number of sub-tasks rather than a field.
+COUNT = 'Count'
+
+
+def split_related_field(field, field_ids):
+    """Return the relation and related field for a related column, or None.
+
+    Real fields win over related columns of the same name.
+    """
+    if field in field_ids:
+        return None
+    relation, _, target = field.partition('.')
+    if relation not in RELATIONS:
+        return None
+    if target in field_ids or (relation == 'Sub-tasks' and target == COUNT):
+        return relation, target
+    return None
+
+
+def _key(ref):
+    """Return the key of an issue or a reference to one."""
+    if isinstance(ref, basestring):
+        return ref
+    return getattr(ref, 'key', None)
+
+
+class RelatedIssues(object):
+    """Cache of related issues, fetched in batches as they are needed."""
+
+    def __init__(self, jira, field_ids, field_schemas,
+                 workers=DEFAULT_WORKERS):
+        self.field_ids = field_ids
+        self.field_schemas = field_schemas
+        self.workers = workers
+        self.fetcher = KeyFetcher(jira)
+        self.source_ids = dict(RELATIONS)
+        self.source_ids['Epic'] = field_ids.get(EPIC_LINK_FIELD)
+        # IDs of the fields needed from each relation's issues.
+        self.targets = dict((relation, set()) for relation in RELATIONS)
+        # The relation and related field of each related column.
+        self.columns = {}
+        self.issues = {}
+        self.missing = set()
+
+    def add_column(self, field, relation, target):
+        """Note a column's related field, returning the relation's field ID."""
+        self.columns[field] = relation, target
+        if self.source_ids[relation] is None:
+            raise ValueError('%s columns need an %s field' %
+                             (relation, EPIC_LINK_FIELD))
+        if target != COUNT:
+            self.targets[relation].add(self.field_ids[target])
+            # Only fetch the fields we need from the related issues.
+            self.fetcher.fields = ','.join(sorted(
+                set.union(*self.targets.values()) - set(['issuekey'])))
+        return self.source_ids[relation]
+
+    def refs(self, relation, raw_value):
+        """Return the list of related issue references in a field value."""
+        if not raw_value:
+            return []
+        if relation == 'Sub-tasks':
+            return list(raw_value)
+        return [raw_value]
+
+    def _embedded(self, ref, relation):
+        """Check if a reference includes all the fields we need from it."""
+        fields = getattr(ref, 'fields', None)
+        return all(target == 'issuekey' or hasattr(fields, target)
+                   for target in self.targets[relation])
+
+    def prefetch(self, issues):
+        """Fetch the related issues of a batch of issues we don't yet have."""
+        for issue in issues:
+            self.issues[issue.key] = issue
+        keys = []
+        seen = set()
+        for relation, targets in self.targets.iteritems():
+            if not targets or targets == set(['issuekey']):
+                continue
+            for issue in issues:
+                raw_value = getattr(issue.fields, self.source_ids[relation],
+                                    None)
+                for ref in self.refs(relation, raw_value):
+                    key = _key(ref)
+                    if (key and key not in seen and key not in self.issues and
+                            key not in self.missing and
+                            not self._embedded(ref, relation)):
+                        seen.add(key)
+                        keys.append(key)
+        if not keys:
+            return
+        info('Fetching %s related issues.' % len(keys))
+        found, missing = self.fetcher.fetch(keys, self.workers)
+        self.issues.update(found)
+        self.missing.update(missing)
+
+    def resolve(self, relation, ref):
+        """Return the related issue for a reference, or None if not found.
+
+        Issues that weren't prefetched are fetched on their own.
+        """
+        key = _key(ref)
+        if key in self.issues:
+            return self.issues[key]
+        if not isinstance(ref, basestring) and self._embedded(ref, relation):
+            return ref
+        if key in self.missing:
+            return None
+        debug('Fetching related issue %s on its own.' % key)
+        found, missing = self.fetcher.fetch([key], self.workers)
+        self.issues.update(found)
+        self.missing.update(missing)
+        return found.get(key)
+
+
+class RelatedFieldParser(BasicFieldParser):
+    """Parses a field of related issues, using the field's own parser.
+
+    The raw values are the relation field, e.g. the parent, and the related
+    issues are looked up from the shared RelatedIssues cache.
+    """
+
+    def __init__(self, field_name, issues, jira, delimiter, related,
+                 target_parser):
+        BasicFieldParser.__init__(self, field_name, issues, jira, delimiter)
+        self.relation, self.target = related.columns[field_name]
+        self.related = related
+        self.target_parser = target_parser
+        if self.target == COUNT:
+            self.target_id = None
+            self.column_type = 'integer'
+            return
+        if len(target_parser.headers()) != 1:
+            raise ValueError('Related columns can not use fields split into '
+                             'several columns: ' + field_name)
+        self.target_id = related.field_ids[self.target]
+        self.column_type = column_types(
+            target_parser, related.field_schemas.get(self.target))[0]
+        # Sub-task numbers are summed, everything else is joined.
+        self.summed = (self.relation == 'Sub-tasks' and
+                       self.column_type in ('number', 'integer'))
+        if self.relation == 'Sub-tasks' and not self.summed:
+            self.column_type = 'string'
+
+    def _target_values(self, raw_values):
+        """Return the raw values of the field in each related issue."""
+        values = []
+        for ref in self.related.refs(self.relation, raw_values):
+            if self.target_id == 'issuekey':
+                values.append(_key(ref))
+                continue
+            issue = self.related.resolve(self.relation, ref)
+            if issue is not None:
+                values.append(getattr(issue.fields, self.target_id, u''))
+        return values
+
+    def _total(self, values):
+        """Sum the numeric values, or return None if there aren't any."""
+        total = None
+        for value in values:
+            try:
+                total = (total or 0) + float(value)
+            except (TypeError, ValueError):
+                pass
+        return total
+
+    def parse_values(self, raw_values):
+        if self.target == COUNT:
+            return [unicode(len(self.related.refs(self.relation,
+                                                  raw_values)))]
+        values = self._target_values(raw_values)
+        if self.summed:
+            total = self._total(values)
+            if total is None:
+                return [u'']
+            return self.target_parser.parse_values(total)
+        return [self.delimiter.join(self.target_parser.parse_values(value)[0]
+                                    for value in values)]
+
+    def parse_typed(self, raw_values):
+        if self.target == COUNT:
+            return [len(self.related.refs(self.relation, raw_values))]
+        values = self._target_values(raw_values)
+        if self.summed:
+            total = self._total(values)
+            if total is None:
+                return [None]
+            return self.target_parser.parse_typed(total)
+        if len(values) == 1:
+            return self.target_parser.parse_typed(values[0])
+        return [self.parse_values(raw_values)[0] or None]
@@ -0,0 +1,142 @@
+"""Write the issues from a single fetch to several outputs at once.
+
+The outputs are listed in a JSON file, e.g.
+
+    [
+        {"output": "team_a.txt.gz", "fields": "team_a_fields.txt"},
+        {"output": "team_b.csv", "fields": ["Key", "Summary", "Labels"],
+         "delimiter": ",", "subdelimiter": ";"},
+        {"output": "columns", "format": "columnar"}
+    ]
+
+Each output can set its output filename, fields (a fields filename or a list
+of field names), delimiter, subdelimiter and format. Anything left out is
+taken from the command line options.
+
+Each issue is parsed once for all the outputs, with outputs sharing parsers,
+and their parsed values, wherever they have a field and sub-delimiter in
+common. Delimited outputs are each written from their own background thread,
+so they are compressed and written out concurrently.
+"""
+
+from jiradump.columnar import ColumnarWriter
+from jiradump.writers import open_output
+from logging import debug, info
+import json
+import sys
+
+OUTPUT_FORMATS = ('delimited', 'columnar')
+
+# Options each output can set.
+SINK_OPTIONS = ('output', 'fields', 'delimiter', 'subdelimiter', 'format')
+
+
+def read_sink_specs(filename, defaults):
+    """Read the list of outputs from a JSON file.
+
+    Returns a dict of options for each output, with any options not given
+    taken from the defaults dict.
+    """
+    with open(filename) as specs_file:
+        specs = json.load(specs_file)
+    if not isinstance(specs, list) or not specs:
+        raise ValueError('Outputs file %s must hold a list of outputs' %
+                         filename)
+    merged_specs = []
+    for spec in specs:
+        unknown_options = set(spec) - set(SINK_OPTIONS)
+        if unknown_options:
+            raise ValueError('Unknown output option(s): ' +
+                             ', '.join(unknown_options))
+        merged = dict(defaults)
+        merged.update(spec)
+        if merged['format'] not in OUTPUT_FORMATS:
+            raise ValueError('Unknown output format: ' + merged['format'])
+        if merged['format'] == 'columnar' and not merged['output']:
+            raise ValueError('Columnar output needs an output directory')
+        # Rows are joined as UTF-8, so the delimiter must be too.
+        if isinstance(merged['delimiter'], unicode):
+            merged['delimiter'] = merged['delimiter'].encode('utf-8')
+        merged_specs.append(merged)
+
+    outputs = [spec['output'] for spec in merged_specs]
+    if len(set(outputs)) != len(outputs):
+        raise ValueError('Each output needs its own output file')
+    return merged_specs
+
+
+class Sink(object):
+    """One of several outputs, with its own fields and format.
+
+    parsers maps each of the fields to its parser, which may be shared with
+    other sinks.
+    """
+
+    def __init__(self, spec, fields):
+        self.filename = spec['output']
+        self.fields = fields
+        self.delimiter = spec['delimiter']
+        self.subdelimiter = spec['subdelimiter']
+        self.format = spec['format']
+        self.typed = self.format == 'columnar'
+        self.parsers = {}
+        self.writer = None
+        self.rows = 0
+
+    def open(self, columns, types):
+        """Open the output and write out the header."""
+        if self.typed:
+            self.writer = ColumnarWriter(self.filename, columns, types)
+            return
+        if self.filename:
+            info('Writing output to %s', self.filename)
+        else:
+            debug('Writing output to standard output.')
+        self.writer = open_output(self.filename)
+        # Leave off the newline so we don't add a final blank line.
+        self.writer.write(self.delimiter.join(
+            [column.encode('utf-8') for column in columns]))
+
+    def add(self, values):
+        """Write a row of parsed values."""
+        if self.typed:
+            self.writer.add(values)
+        else:
+            self.writer.write('\n' + self.delimiter.join(values))
+        self.rows += 1
+
+    def close(self):
+        if not self.typed and self.writer.stream == sys.stdout:
+            self.writer.write('\n')
+        self.writer.close()
+
+
+def write_sinks(issues, sinks, field_ids):
+    """Parse each issue once, writing its values to every sink.
+
+    Returns the total number of rows written.
+    """
+    for issue in issues:
+        # Make the key available alongside the other fields, as for a
+        # single output.
+        issue.fields.issuekey = issue.key
+
+        # Parsed values by parser, and whether they are typed, so sinks
+        # sharing a parser share its values too.
+        parsed = {}
+        for sink in sinks:
+            issue_values = []
+            for field in sink.fields:
+                parser = sink.parsers[field]
+                if (parser, sink.typed) not in parsed:
+                    field_values = getattr(issue.fields, field_ids[field],
+                                           u'')
+                    if sink.typed:
+                        field_values = parser.parse_typed(field_values)
+                    else:
+                        field_values = [value.encode('utf-8') for value
+                                        in parser.parse_values(field_values)]
+                    parsed[parser, sink.typed] = field_values
+                issue_values += parsed[parser, sink.typed]
+            sink.add(issue_values)
+    return sum(sink.rows for sink in sinks)
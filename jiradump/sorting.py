@@ -0,0 +1,196 @@
+"""Sort output rows by columns, spilling to temporary files when needed.
+
+Rows are buffered in memory up to a budget, then sorted and spilled as a run
+to a temporary file. Iterating over the sorter merges the runs back together,
+so only one row per run needs to be in memory at a time.
+"""
+
+from datetime import datetime
+from heapq import merge
+from logging import debug
+from tempfile import TemporaryFile
+import dateutil.parser
+import marshal
+
+DEFAULT_SORT_MEMORY = 64
+
+SORT_TYPES = ('string', 'numeric', 'date')
+
+# Most sorted runs to have open at once. Beyond this, runs are merged
+# together into one bigger run before carrying on.
+MAX_OPEN_RUNS = 64
+
+# Rough per row and per value overheads of the Python objects holding a row,
+# used to estimate how much memory buffered rows take up.
+_ROW_OVERHEAD = 72
+_VALUE_OVERHEAD = 40
+
+
+class _Descending(object):
+    """Wraps a value to reverse its sort order."""
+
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+
+def _numeric(value):
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def _date(value):
+    # Dates we write ourselves are all in one format, so try that quickly
+    # before falling back on the much slower general parser.
+    try:
+        return datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+    except ValueError:
+        pass
+    try:
+        return dateutil.parser.parse(value)
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+def _string(value):
+    return value
+
+
+_CONVERTERS = {
+    'string': _string,
+    'numeric': _numeric,
+    'date': _date,
+}
+
+
+def parse_sort_spec(spec):
+    """Split a COLUMN[:TYPE][:desc] sort spec into its parts.
+
+    Returns a tuple of the column name, the type and whether to sort in
+    descending order.
+    """
+    parts = spec.split(':')
+    descending = False
+    if len(parts) > 1 and parts[-1].lower() in ('asc', 'desc'):
+        descending = parts.pop().lower() == 'desc'
+    sort_type = 'string'
+    if len(parts) > 1 and parts[-1].lower() in SORT_TYPES:
+        sort_type = parts.pop().lower()
+    return ':'.join(parts), sort_type, descending
+
+
+def make_sort_key(specs, columns):
+    """Build a function returning the sort key for a row.
+
+    specs are COLUMN[:TYPE][:desc] strings, and columns the output headers.
+    Empty or unparseable values sort last, whichever the direction.
+    """
+    sort_columns = []
+    for spec in specs:
+        column, sort_type, descending = parse_sort_spec(spec)
+        if column not in columns:
+            raise ValueError('Unknown sort column: ' + column)
+        debug('Sorting by %s as %s%s.' %
+              (column, sort_type, ', descending' if descending else ''))
+        sort_columns.append((columns.index(column), _CONVERTERS[sort_type],
+                             descending))
+
+    def sort_key(row):
+        key = []
+        for index, convert, descending in sort_columns:
+            value = convert(row[index]) if row[index] else None
+            if value is None:
+                key.append((1, None))
+            elif descending:
+                key.append((0, _Descending(value)))
+            else:
+                key.append((0, value))
+        return key
+
+    return sort_key
+
+
+class ExternalSorter(object):
+    """Sorts rows of UTF-8 strings within a memory budget.
+
+    Add rows with add(), then iterate over the sorter for them in order.
+    Sorting is stable, so rows with equal keys keep their original order.
+    """
+
+    def __init__(self, key, memory_limit=DEFAULT_SORT_MEMORY * 1024 * 1024,
+                 temp_dir=None):
+        self.key = key
+        self.memory_limit = memory_limit
+        self.temp_dir = temp_dir
+        self.rows = []
+        self.runs = []
+        self._size = 0
+
+    def add(self, row):
+        self.rows.append(row)
+        self._size += (_ROW_OVERHEAD + _VALUE_OVERHEAD * len(row) +
+                       sum(len(value) for value in row))
+        if self._size >= self.memory_limit:
+            self._spill()
+
+    def _spill(self):
+        """Sort the buffered rows and write them out as a run."""
+        debug('Spilling a sorted run of %s rows.' % len(self.rows))
+        self.rows.sort(key=self.key)
+        run = TemporaryFile(dir=self.temp_dir)
+        for row in self.rows:
+            marshal.dump(row, run)
+        run.seek(0)
+        self.runs.append(run)
+        self.rows = []
+        self._size = 0
+        if len(self.runs) >= MAX_OPEN_RUNS:
+            self._merge_runs()
+
+    def _merge_runs(self):
+        """Merge all the runs so far into a single run."""
+        debug('Merging %s sorted runs into one.' % len(self.runs))
+        merged = TemporaryFile(dir=self.temp_dir)
+        for row in self._merged():
+            marshal.dump(row, merged)
+        merged.seek(0)
+        self.runs = [merged]
+
+    def _read_run(self, run_number, run):
+        position = 0
+        try:
+            while True:
+                row = marshal.load(run)
+                yield self.key(row), run_number, position, row
+                position += 1
+        except EOFError:
+            run.close()
+
+    def __iter__(self):
+        if not self.runs:
+            self.rows.sort(key=self.key)
+            for row in self.rows:
+                yield row
+            return
+
+        if self.rows:
+            self._spill()
+        for row in self._merged():
+            yield row
+
+    def _merged(self):
+        """Yield the rows of all the runs, merged into order."""
+        debug('Merging %s sorted runs.' % len(self.runs))
+        runs = [self._read_run(number, run)
+                for number, run in enumerate(self.runs)]
+        for _, _, _, row in merge(*runs):
+            yield row
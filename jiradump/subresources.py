@@ -0,0 +1,150 @@
+"""Export issue sub-resources, such as comments and worklogs, in bulk.
+
+Comments and worklogs come back inside the issue search results when their
+fields are requested, so most issues need no extra requests at all. JIRA cuts
+these embedded lists short on busy issues, and only those are fetched again
+individually, using a pool of concurrent requests.
+"""
+
+from jiradump.parsers import BasicFieldParser, DateTimeFieldParser, \
+    SecondsDurationParser
+from logging import debug, info
+from multiprocessing.pool import ThreadPool
+
+DEFAULT_WORKERS = 4
+
+
+def _display_name(user):
+    """Return the display name of a raw JIRA user, if any."""
+    if not user:
+        return u''
+    return user.get('displayName') or user.get('name') or u''
+
+
+class SubResourceExporter(object):
+    """Writes one delimited row per sub-resource item, keyed by issue key.
+
+    Subclasses name the issue field holding the embedded list, the key of the
+    list within that field, and how to turn an item into row values.
+    """
+
+    field_id = None
+    items_key = None
+    headers = ()
+
+    def __init__(self, jira, delimiter, subdelimiter):
+        self.jira = jira
+        self.delimiter = delimiter
+        self.subdelimiter = subdelimiter
+
+    def _fetch_items(self, issue_key):
+        """Fetch the full list of raw items for a single issue."""
+        raise NotImplementedError
+
+    def _item_values(self, item):
+        """Return the unicode values for one raw item, after the issue key."""
+        raise NotImplementedError
+
+    def _embedded(self, issue):
+        """Return the embedded items of the issue and whether it is complete.
+        """
+        embedded = issue.raw['fields'].get(self.field_id) or {}
+        items = embedded.get(self.items_key) or []
+        return items, embedded.get('total', len(items)) <= len(items)
+
+    def _fetch_truncated(self, issues, workers):
+        """Fetch the full lists for issues with truncated embedded lists."""
+        truncated = [issue.key for issue in issues
+                     if not self._embedded(issue)[1]]
+        if not truncated:
+            return {}
+        info('Fetching %s for %s issues with truncated lists.' %
+             (self.items_key, len(truncated)))
+        pool = ThreadPool(workers)
+        try:
+            return dict(zip(truncated, pool.map(self._fetch_items,
+                                                truncated)))
+        finally:
+            pool.close()
+
+    def write(self, issues, output, workers=DEFAULT_WORKERS):
+        """Write the header and a row for every item of every issue.
+
+        Returns the number of rows written.
+        """
+        fetched = self._fetch_truncated(issues, workers)
+
+        output.write(self.delimiter.join(self.headers))
+        rows_written = 0
+        for issue in issues:
+            items = fetched.get(issue.key) or self._embedded(issue)[0]
+            for item in items:
+                values = [issue.key] + self._item_values(item)
+                # Line breaks would split the row, so keep them escaped.
+                values = [value.replace(u'\r\n', u'\\n').replace(
+                    u'\n', u'\\n').replace(u'\r', u'\\n').encode('utf-8')
+                    for value in values]
+                output.write('\n' + self.delimiter.join(values))
+                rows_written += 1
+        debug('Wrote %s %s.' % (rows_written, self.items_key))
+        return rows_written
+
+
+class CommentExporter(SubResourceExporter):
+    """Exports issue comments."""
+
+    field_id = 'comment'
+    items_key = 'comments'
+    headers = ('Key', 'Comment ID', 'Author', 'Created', 'Updated', 'Body')
+
+    def __init__(self, jira, delimiter, subdelimiter):
+        SubResourceExporter.__init__(self, jira, delimiter, subdelimiter)
+        self.date_parser = DateTimeFieldParser('Created', [], jira,
+                                               subdelimiter)
+        self.body_parser = BasicFieldParser('Body', [], jira, subdelimiter)
+
+    def _fetch_items(self, issue_key):
+        return [comment.raw for comment in self.jira.comments(issue_key)]
+
+    def _item_values(self, item):
+        return [unicode(item.get('id', u'')),
+                _display_name(item.get('author')),
+                self.date_parser.parse_values(item.get('created'))[0],
+                self.date_parser.parse_values(item.get('updated'))[0],
+                self.body_parser.parse_values(item.get('body'))[0]]
+
+
+class WorklogExporter(SubResourceExporter):
+    """Exports issue worklogs, with time spent in decimal days."""
+
+    field_id = 'worklog'
+    items_key = 'worklogs'
+    headers = ('Key', 'Worklog ID', 'Author', 'Started', 'Time Spent',
+               'Comment')
+
+    def __init__(self, jira, delimiter, subdelimiter):
+        SubResourceExporter.__init__(self, jira, delimiter, subdelimiter)
+        self.date_parser = DateTimeFieldParser('Started', [], jira,
+                                               subdelimiter)
+        self.duration_parser = SecondsDurationParser('Time Spent', [], jira,
+                                                     subdelimiter)
+        self.comment_parser = BasicFieldParser('Comment', [], jira,
+                                               subdelimiter)
+
+    def _fetch_items(self, issue_key):
+        return [worklog.raw for worklog in self.jira.worklogs(issue_key)]
+
+    def _item_values(self, item):
+        return [unicode(item.get('id', u'')),
+                _display_name(item.get('author')),
+                self.date_parser.parse_values(item.get('started'))[0],
+                self.duration_parser.parse_values(
+                    item.get('timeSpentSeconds'))[0],
+                self.comment_parser.parse_values(item.get('comment'))[0]]
+
+
+# Command line option names, and the exporters they turn on.
+SUBRESOURCE_EXPORTERS = (
+    ('comments', CommentExporter),
+    ('worklogs', WorklogExporter),
+)
@@ -0,0 +1,52 @@
+"""Hooks into the HTTP transport underneath the JIRA client."""
+
+from contextlib import contextmanager
+from requests.adapters import BaseAdapter
+from requests.sessions import Session
+
+
+class ForwardingAdapter(BaseAdapter):
+    """A requests transport adapter which passes everything on to another.
+
+    Subclasses override send() to watch or change the requests the JIRA
+    client makes, without needing to know anything about the client itself.
+    """
+
+    def __init__(self, adapter):
+        BaseAdapter.__init__(self)
+        self.adapter = adapter
+
+    def send(self, request, **kwargs):
+        return self.adapter.send(request, **kwargs)
+
+    def close(self):
+        self.adapter.close()
+
+
+def wrap_adapters(session, wrapper):
+    """Wrap every transport adapter mounted on the session.
+
+    wrapper is called with each existing adapter and returns its replacement.
+    """
+    for prefix, adapter in list(session.adapters.items()):
+        session.mount(prefix, wrapper(adapter))
+
+
+@contextmanager
+def wrapped_sessions(wrapper):
+    """Wrap the adapters of every requests session created in the block.
+
+    The JIRA client makes requests while it is being constructed, so its
+    session needs wrapping from the moment it is created.
+    """
+    original_init = Session.__init__
+
+    def __init__(session, *args, **kwargs):
+        original_init(session, *args, **kwargs)
+        wrap_adapters(session, wrapper)
+
+    Session.__init__ = __init__
+    try:
+        yield
+    finally:
+        Session.__init__ = original_init
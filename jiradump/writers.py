@@ -0,0 +1,248 @@
+"""Buffered, optionally compressed output written from a background thread."""
+
+from logging import debug, error
+from Queue import Queue, Empty, Full
+from threading import Thread
+import atexit
+import bz2
+import os
+import sys
+import time
+import zlib
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+# Size of the buffer used for output files, and the amount of queued data we
+# try to gather up before handing it to a single write call.
+OUTPUT_BUFFER_SIZE = 1024 * 1024
+
+# Maximum number of pending writes before the producer blocks.
+DEFAULT_QUEUE_SIZE = 4096
+
+# Seconds to block at a time waiting on the writer thread. Python 2 can't
+# interrupt a wait without a timeout, so waiting in short steps lets Ctrl-C
+# through.
+_WAIT_STEP = 0.5
+
+# Longest to wait for queued output to be written out when closing at exit,
+# and when exiting after an interrupt, when we shouldn't keep the user
+# waiting on output which may never be read.
+EXIT_CLOSE_TIMEOUT = 10
+INTERRUPTED_CLOSE_TIMEOUT = 2
+
+# zlib compressors are the only ones that can flush out what they have so far
+# without ending the compressed stream.
+_SYNC_FLUSH_TYPES = (type(zlib.compressobj()),)
+
+# Markers passed through the queue to control the writer thread.
+_FLUSH = object()
+_CLOSE = object()
+
+
+def _gzip_compressor():
+    """A zlib compressor producing gzip formatted output."""
+    return zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+
+def _xz_compressor():
+    """An LZMA compressor producing xz formatted output."""
+    if lzma is None:
+        raise ValueError('xz output requires the lzma module (try installing '
+                         'backports.lzma)')
+    return lzma.LZMACompressor()
+
+
+# Output file extensions which turn on compression, and a factory for the
+# compressor to use.
+COMPRESSORS = {
+    '.gz': _gzip_compressor,
+    '.bz2': bz2.BZ2Compressor,
+    '.xz': _xz_compressor,
+}
+
+
+def get_compressor(filename):
+    """Return a new compressor for the filename's extension, if any."""
+    for extension, compressor in COMPRESSORS.iteritems():
+        if filename.endswith(extension):
+            debug('Compressing output with %s.' % extension)
+            return compressor()
+    return None
+
+
+def open_output(filename=None, queue_size=DEFAULT_QUEUE_SIZE):
+    """Open a threaded writer for the filename, or standard out if not given.
+
+    Output files ending in .gz, .bz2 or .xz are compressed on the fly. The
+    writer is closed at exit, so that if we stop on an error, whatever was
+    already queued is still written out and compressed files are properly
+    ended.
+    """
+    if not filename:
+        writer = ThreadedWriter(sys.stdout, queue_size=queue_size)
+    else:
+        # Set up the compressor first, so an unsupported one doesn't leave an
+        # empty file behind.
+        compressor = get_compressor(filename)
+        writer = ThreadedWriter(open(filename, 'wb', OUTPUT_BUFFER_SIZE),
+                                compressor=compressor, queue_size=queue_size)
+    atexit.register(_close_at_exit, writer)
+    return writer
+
+
+def _close_at_exit(writer):
+    """Close the writer, logging any error rather than raising it again."""
+    timeout = EXIT_CLOSE_TIMEOUT
+    if getattr(sys, 'last_type', None) is KeyboardInterrupt:
+        timeout = INTERRUPTED_CLOSE_TIMEOUT
+    try:
+        writer.close(timeout)
+    except Exception as err:
+        error('Failed to finish writing output: %s' % err)
+
+
+class ThreadedWriter(object):
+    """Writes to a stream from a background thread fed by a bounded queue.
+
+    Callers hand over data with write() and carry on fetching and parsing
+    while the thread gathers the queued data into large chunks, compresses
+    it if asked, and writes it out. Any error hit by the thread is raised
+    from the next call to write(), flush() or close().
+    """
+
+    def __init__(self, stream, compressor=None,
+                 queue_size=DEFAULT_QUEUE_SIZE):
+        self.stream = stream
+        self.compressor = compressor
+        if stream is sys.stdout:
+            # Anything already buffered must come first.
+            stream.flush()
+        self._queue = Queue(queue_size)
+        self._error = None
+        self._closed = False
+        self._thread = Thread(target=self._run, name='jiradump-writer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def write(self, data):
+        """Queue the data to be written, which must be a byte string."""
+        if isinstance(data, unicode):
+            raise TypeError('Output must be encoded before writing')
+        self._raise_error()
+        self._put(data)
+
+    def flush(self):
+        """Queue a flush of everything written so far to the stream."""
+        self._raise_error()
+        self._put(_FLUSH)
+
+    def close(self, timeout=None):
+        """Write out anything still queued, wait for the thread and close.
+
+        Standard output is flushed, but left open. If a timeout is given, give
+        up waiting after that many seconds.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        if not self._closed:
+            self._put(_CLOSE, deadline)
+            self._closed = True
+        while self._thread.is_alive():
+            self._check_deadline(deadline)
+            self._thread.join(_WAIT_STEP)
+        self._raise_error()
+
+    def _put(self, item, deadline=None):
+        """Queue an item, waiting in steps so we can still be interrupted."""
+        while True:
+            try:
+                self._queue.put(item, timeout=_WAIT_STEP)
+                return
+            except Full:
+                self._check_deadline(deadline)
+
+    @staticmethod
+    def _check_deadline(deadline):
+        if deadline is not None and time.time() > deadline:
+            raise IOError('Timed out waiting for output to be written')
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def _next_chunk(self):
+        """Block for the next item, then gather up whatever else is queued.
+
+        Returns the list of data and any control marker which ended the
+        chunk.
+        """
+        chunk = []
+        size = 0
+        item = self._queue.get()
+        while item is not _FLUSH and item is not _CLOSE:
+            chunk.append(item)
+            size += len(item)
+            if size >= OUTPUT_BUFFER_SIZE:
+                item = None
+                break
+            try:
+                item = self._queue.get_nowait()
+            except Empty:
+                item = None
+                break
+        return chunk, item
+
+    def _write_chunk(self, data, marker):
+        if self.compressor:
+            data = self.compressor.compress(data)
+            if marker is _CLOSE:
+                data += self.compressor.flush()
+            elif (marker is _FLUSH and
+                  isinstance(self.compressor, _SYNC_FLUSH_TYPES)):
+                data += self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            self._write_stream(data)
+        if marker is _FLUSH:
+            self.stream.flush()
+        elif marker is _CLOSE:
+            if self.stream is sys.stdout:
+                self.stream.flush()
+            else:
+                self.stream.close()
+
+    def _write_stream(self, data):
+        """Write the data out.
+
+        Standard output is written to with os.write, so that a reader which
+        stops reading only blocks this thread, rather than also holding the
+        lock on sys.stdout, which the main thread needs to report an error or
+        interrupt and exit.
+        """
+        if self.stream is not sys.stdout:
+            self.stream.write(data)
+            return
+        while data:
+            data = data[os.write(self.stream.fileno(), data):]
+
+    def _run(self):
+        """Drain the queue until closed.
+
+        After an error we keep draining, and discarding, so that the
+        producer never blocks on a full queue.
+        """
+        while True:
+            marker = None
+            try:
+                chunk, marker = self._next_chunk()
+                if self._error is None:
+                    self._write_chunk(''.join(chunk), marker)
+            except Exception as err:
+                if self._error is None:
+                    self._error = err
+            if marker is _CLOSE:
+                return
@@ -14,7 +14,10 @@ setup(name='jiradump',
       url='https://github.com/frobnic8/jiradump',
       download_url='https://github.com/frobnic8/jiradump/tree/master/dist',
       packages=['jiradump'],
-      entry_points={'console_scripts': ['jiradump = jiradump:main']},
+      entry_points={'console_scripts': [
+          'jiradump = jiradump:main',
+          'jiradump-index = jiradump.index:main',
+      ]},
       long_description=open('README.md').read(),
       install_requires=[
           'jira-python >= 0.16',